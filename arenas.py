@@ -0,0 +1,130 @@
+"""
+Many copies of the arena stepped together, for training bots.
+
+The game itself keeps everything in globals and plays one match at a time,
+Arenas keeps count matches in one PlayerPool and one ShotPool instead. The
+arenas are put next to eachother in one big level, with a column of nothing
+between them, so the rules in game.py (update_players, update_shots,
+shot_hits and solve_walls) run on all of them at once, without knowing
+there is more than one. Nothing is drawn and pygame is never started.
+
+    env = Arenas(1024)
+    observations = env.reset()
+    while training:
+        observations, rewards, done = env.step(actions)
+"""
+import numpy as np
+
+import game
+
+
+class Arenas:
+    """
+        count arenas with players players each, stepped in lockstep.
+
+        Actions are an array of shape (count, players, 4), for every player
+        how much to move along x and y (-1 to 1), if it shoots (> 0.5) and
+        if it wants to be small (> 0.5).
+
+        step returns observations, rewards and done:
+        - observations, shape (count, players, 7 + 5 * (players - 1)), for
+          every player its position in the arena, velocity, size, if it is
+          small and the time until it can shoot again, and then for every
+          other player in the arena its position relative to the player,
+          velocity and size.
+        - rewards, shape (count, players), +1 for every enemy hit and -1
+          for every time the player was hit.
+        - done, shape (count, ), True for the arenas where someone was hit or
+          that ran for max_steps. Those arenas are already reset, and their
+          observations are the start of the next round.
+    """
+    ACTIONS = 4
+
+    def __init__(self, count, players=2, level=game.LEVEL, max_steps=60 * 60, delta=1 / 60):
+        self.count = count
+        self.players = players
+        self.max_steps = max_steps
+        self.delta = delta
+
+        walls, starts = game.parse_level(level)
+        solid = walls.tile_wall >= 0
+        gap = np.zeros((len(solid), 1), dtype=bool)
+        self.walls = game.WallGrid(np.hstack([solid, gap] * count), walls.grid_size,
+                                   merge=True)
+        # How far every arena is from the one before it.
+        self.arena_width = (solid.shape[1] + 1) * walls.grid_size
+
+        self.pool = game.PlayerPool(count * players)
+        self.shots = game.ShotPool()
+        for row in range(count * players):
+            self.pool.add(row + 1)
+        rows = np.arange(count * players)
+        self.origins = np.zeros((count * players, 2))
+        self.origins[:, 0] = (rows // players) * self.arena_width
+        self.spawns = self.origins + np.asarray(starts, dtype=float)[rows % players % len(starts)]
+        self.steps = np.zeros(count, dtype=int)
+
+    def reset(self):
+        """Starts a new round in every arena, and returns the observations."""
+        self._reset(np.arange(self.count))
+        return self.observe()
+
+    def _reset(self, arenas):
+        """Internal function, starts a new round in the arenas."""
+        pool = self.pool
+        rows = (arenas[:, None] * self.players + np.arange(self.players)).ravel()
+        pool.position[rows] = self.spawns[rows]
+        pool.last_position[rows] = self.spawns[rows]
+        pool.size[rows] = game.Player.max_size
+        for name in ("velocity", "small", "shot_timeout", "move", "shoot", "toggle_small"):
+            getattr(pool, name)[rows] = 0
+
+        resetting = np.zeros(self.count, dtype=bool)
+        resetting[arenas] = True
+        n = len(self.shots)
+        self.shots.remove(np.flatnonzero(
+            resetting[(self.shots.shooter_idx[:n] - 1) // self.players]))
+        self.steps[arenas] = 0
+
+    def step(self, actions):
+        """Plays one step in every arena, see the class for what comes in and out."""
+        k, p = self.count, self.players
+        n = k * p
+        pool = self.pool
+        actions = np.asarray(actions, dtype=float).reshape(n, self.ACTIONS)
+        pool.move[:n] = np.clip(actions[:, :2], -1, 1)
+        pool.shoot[:n] = actions[:, 2] > 0.5
+        pool.toggle_small[:n] = (actions[:, 3] > 0.5) != pool.small[:n]
+
+        game.update_players(pool, self.delta, self.shots)
+        game.update_shots(self.shots, self.delta, self.walls)
+        victims, shooters = game.shot_hits(self.shots, pool)
+        game.solve_walls(pool, self.walls)
+
+        rewards = np.zeros(n, dtype=np.float32)
+        np.add.at(rewards, shooters - 1, 1)
+        np.add.at(rewards, victims, -1)
+
+        self.steps += 1
+        done = self.steps >= self.max_steps
+        done[victims // p] = True
+        if done.any():
+            self._reset(np.flatnonzero(done))
+        return self.observe(), rewards.reshape(k, p), done
+
+    def observe(self):
+        """The observations of every player, see the class for what is in them."""
+        k, p = self.count, self.players
+        n = k * p
+        pool = self.pool
+        position = (pool.position[:n] - self.origins).reshape(k, p, 2)
+        velocity = pool.velocity[:n].reshape(k, p, 2)
+        size = pool.size[:n].reshape(k, p, 1)
+        parts = [position, velocity, size,
+                 pool.small[:n].reshape(k, p, 1),
+                 pool.shot_timeout[:n].reshape(k, p, 1)]
+        for other in range(1, p):
+            parts += [np.roll(position, -other, axis=1) - position,
+                      np.roll(velocity, -other, axis=1),
+                      np.roll(size, -other, axis=1)]
+        return np.concatenate(parts, axis=2, dtype=np.float32)
@@ -0,0 +1,651 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the slow parts of the game.
+
+Run with `python3 bench.py`, no window is opened. The frame benchmarks play
+scripted matches and time every phase of a frame, save them with --json and
+compare against an old run with --baseline.
+"""
+import gc
+import os
+import sys
+import json
+import math
+import random
+import argparse
+import statistics
+from dataclasses import dataclass
+from time import perf_counter
+
+# Draw to memory and play sound to nowhere, must be set before pygame starts.
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+import numpy as np
+import ribs
+import game
+import arenas
+import snapshots
+from ribs import *
+
+
+class Body:
+    """A shot as a single object, for the collision code that needs one."""
+    __slots__ = ("centerx", "centery", "width", "height", "shooter_idx")
+
+    def __init__(self, centerx, centery, size, shooter_idx):
+        self.centerx = centerx
+        self.centery = centery
+        self.width = self.height = size
+        self.shooter_idx = shooter_idx
+
+
+def random_shots(count, size, rng):
+    """Fills a pool with count shots from both players, over a size x size arena."""
+    pool = game.ShotPool()
+    for _ in range(count):
+        pool.add(rng.uniform(0, size), rng.uniform(0, size), (0, 0),
+                 rng.choice((1, 2)))
+    return pool
+
+
+def pool_bodies(pool):
+    """The shots in the pool as one Body each."""
+    n = len(pool)
+    return [Body(x, y, size, idx) for (x, y), size, idx in
+            zip(pool.position[:n].tolist(), pool.size[:n].tolist(),
+                pool.shooter_idx[:n].tolist())]
+
+
+def brute_collide(bodies, players):
+    """The original collision code, checks every shot against every other shot."""
+    dead = set()
+    hits = []
+    for shot in bodies:
+        for other in bodies:
+            if shot.shooter_idx != other.shooter_idx:
+                _, depth = overlap_data(shot, other)
+                if depth > 0:
+                    dead.add(id(shot))
+        for player in players:
+            _, depth = overlap_data(player, shot)
+            if depth > 0 and player.idx != shot.shooter_idx:
+                hits.append((player, shot.shooter_idx))
+    return hits
+
+
+class SpatialHash:
+    """
+        The broadphase the game used before overlapping_pairs, to compare
+        against: sorts bodies into a grid of square cells in pure python,
+        so only bodies that are close to eachother are checked.
+
+        A body is anything with centerx, centery, width and height, just like
+        for overlap_data. The hash doesn't notice when bodies move, so call
+        build again every frame.
+    """
+
+    def __init__(self, cell_size=40):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _cell_range(self, body):
+        """Internal function, the first and last cell the body touches."""
+        half_w = body.width / 2
+        half_h = body.height / 2
+        size = self.cell_size
+        return (int((body.centerx - half_w) // size),
+                int((body.centery - half_h) // size),
+                int((body.centerx + half_w) // size),
+                int((body.centery + half_h) // size))
+
+    def clear(self):
+        """Removes all bodies from the hash."""
+        self.cells.clear()
+
+    def insert(self, body):
+        """Adds a body to every cell it touches."""
+        min_x, min_y, max_x, max_y = self._cell_range(body)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                cell = self.cells.get((x, y))
+                if cell is None:
+                    self.cells[(x, y)] = [body]
+                else:
+                    cell.append(body)
+
+    def build(self, bodies):
+        """Clears the hash and inserts all the bodies."""
+        self.clear()
+        for body in bodies:
+            self.insert(body)
+
+    def query(self, body):
+        """
+            Returns the bodies that share a cell with body. They might not
+            actually overlap, use overlap_data to find out.
+        """
+        found = {}
+        min_x, min_y, max_x, max_y = self._cell_range(body)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                for other in self.cells.get((x, y), ()):
+                    found[id(other)] = other
+        found.pop(id(body), None)
+        return list(found.values())
+
+    def pairs(self):
+        """
+            Yields every pair of bodies that share a cell, once per pair.
+            Like query, the pairs are only candidates.
+        """
+        seen = set()
+        for cell in self.cells.values():
+            for i, a in enumerate(cell):
+                for b in cell[i + 1:]:
+                    # A body in more than one cell would show up twice.
+                    key = (id(a), id(b)) if id(a) < id(b) else (id(b), id(a))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    yield a, b
+
+
+def hash_collide(grid, bodies, players):
+    """Collision code for shot objects, using a SpatialHash."""
+    grid.build(bodies)
+    dead = set()
+    for shot, other in grid.pairs():
+        if shot.shooter_idx != other.shooter_idx:
+            _, depth = overlap_data(shot, other)
+            if depth > 0:
+                dead.add(id(shot))
+                dead.add(id(other))
+    hits = []
+    for player in players:
+        for shot in grid.query(player):
+            _, depth = overlap_data(player, shot)
+            if depth > 0 and player.idx != shot.shooter_idx:
+                hits.append((player, shot.shooter_idx))
+    return hits
+
+
+def time_frames(step, setup, frames):
+    """Median time in milliseconds for a single call to step."""
+    samples = []
+    for _ in range(frames):
+        setup()
+        start = perf_counter()
+        step()
+        samples.append((perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def bench_collisions(counts=(10, 100, 1000, 10000, 50000), spacing=40, brute_limit=1000,
+                     frames=5):
+    """How the collision step grows with the number of live shots."""
+    walls, starts = game.parse_level(game.LEVEL)
+    level_size = max(wall.right for wall in walls)
+    players = game.PlayerPool()
+    for idx in range(1, len(starts) + 1):
+        players.add(idx)
+    game.spawn(players, starts)
+
+    grid = SpatialHash(cell_size=game.Player.max_size)
+    print(f"{'shots':>8} {'pool ms':>10} {'hash ms':>10} {'brute ms':>10}")
+    for count in counts:
+        # Grow the arena with the shot count, otherwise 10 000 shots in the
+        # small level all overlap eachother and die in the first frame.
+        arena = max(level_size, math.sqrt(count) * spacing)
+        all_shots = random_shots(count, arena, random.Random(count))
+        bodies = pool_bodies(all_shots)
+        pool = game.ShotPool()
+
+        def setup():
+            for name in pool.ARRAYS:
+                setattr(pool, name, getattr(all_shots, name).copy())
+            pool.count = all_shots.count
+            pool.per_shooter = all_shots.per_shooter.copy()
+
+        pooled = time_frames(lambda: game.collide_shots(pool, players), setup, frames)
+        hashed = time_frames(lambda: hash_collide(grid, bodies, players),
+                             lambda: None, frames)
+        if count <= brute_limit:
+            brute = time_frames(lambda: brute_collide(bodies, players),
+                                lambda: None, frames)
+            brute = f"{brute:10.2f}"
+        else:
+            brute = f"{'-':>10}"
+        print(f"{count:8} {pooled:10.2f} {hashed:10.2f} {brute}")
+
+
+#
+# Frame benchmarks
+#
+
+PHASES = ("input", "player update", "shot update", "collision", "walls", "draw",
+          "present")
+
+# The keys of both players, in the order up, down, left, right, small, shoot.
+PLAYER_KEYS = ("wsadfc", "ikjlhn")
+
+
+def idle_keys(frame):
+    """Nobody touches the keyboard."""
+    return set()
+
+
+def spray_keys(frame):
+    """Both players run around in squares while holding fire."""
+    held = set()
+    for i, (up, down, left, right, small, shoot) in enumerate(PLAYER_KEYS):
+        held.add((up, right, down, left)[(frame // 30 + i) % 4])
+        held.add(shoot)
+    return {ord(key) for key in held}
+
+
+def arena(size, starts=((2, 2), (6, 2))):
+    """An empty square level, size tiles wide, with the starts in a corner."""
+    rows = [[" "] * size for _ in range(size)]
+    for i in range(size):
+        rows[0][i] = rows[-1][i] = rows[i][0] = rows[i][-1] = "#"
+    for x, y in starts:
+        rows[y][x] = "S"
+    return "\n".join("".join(row) for row in rows)
+
+
+def fill_shots(count):
+    """
+        Keeps at least count shots flying in the far corner of the level,
+        away from the players, so they are moved, collided and drawn every
+        frame. They belong to nobody playing, so the players can still fire.
+    """
+    def setup(frame):
+        for i in range(len(game.shots), count):
+            game.shots.add(480 + (i % 40) * 12, 480 + (i // 40) * 12, (5, 0), 3 + i % 2)
+    return setup
+
+
+# Every scenario is the keys held every frame, something to run before
+# every frame and the level to play on.
+SCENARIOS = {
+    "idle": (idle_keys, None, game.LEVEL),
+    "spray": (spray_keys, None, game.LEVEL),
+    "crowded": (spray_keys, fill_shots(2000), arena(30)),
+}
+
+
+def run_scenario(name, frames):
+    """Plays a scenario and returns the timings in milliseconds."""
+    keys, setup, level = SCENARIOS[name]
+    game.shots.clear()
+    current_frame_held_buttons.clear()
+    game.LEVEL, old_level = level, game.LEVEL
+    updater = game.update()
+
+    frame_times = []
+    phase_times = {phase: [] for phase in PHASES}
+    shot_counts = []
+    for frame in range(frames):
+        if setup:
+            setup(frame)
+        SECTION_TIMES.clear()
+        start = perf_counter()
+        with timed("input"):
+            process_events()
+            current_frame_held_buttons.clear()
+            current_frame_held_buttons.update(keys(frame))
+        next(updater)
+        game.draw()
+        with timed("present"):
+            present()
+        frame_times.append((perf_counter() - start) * 1000)
+        for phase in PHASES:
+            phase_times[phase].append(SECTION_TIMES.get(phase, 0) * 1000)
+        shot_counts.append(len(game.shots))
+    game.LEVEL = old_level
+
+    return {
+        "frames": frames,
+        "mean shots": statistics.mean(shot_counts),
+        "frame ms": {
+            "mean": statistics.mean(frame_times),
+            "p50": percentile(frame_times, 50),
+            "p95": percentile(frame_times, 95),
+            "max": max(frame_times),
+        },
+        "phase ms": {phase: statistics.mean(times) for phase, times in phase_times.items()},
+    }
+
+
+def start_pygame():
+    """Opens a (dummy) window and loads the assets, like start_game does."""
+    pg.init()
+    pg.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    game.init()
+
+
+def bench_frames(names, frames):
+    """Runs the scenarios and prints a table of the mean phase times."""
+    start_pygame()
+
+    report = {}
+    print(f"{'scenario':>10} {'shots':>7} {'frame':>7} {'p95':>7} " +
+          " ".join(f"{phase[:10]:>10}" for phase in PHASES) + "   (ms)")
+    for name in names:
+        result = report[name] = run_scenario(name, frames)
+        print(f"{name:>10} {result['mean shots']:7.0f} "
+              f"{result['frame ms']['mean']:7.3f} {result['frame ms']['p95']:7.3f} " +
+              " ".join(f"{result['phase ms'][phase]:10.3f}" for phase in PHASES))
+    pg.quit()
+    return report
+
+
+#
+# Memory
+#
+
+# The Shot and Player of the first version of game.py, one object per
+# shot and per player, to measure the pools against.
+@dataclass
+class BaselineShot:
+    centerx = 0
+    centery = 0
+    size = 10
+    width = height = size
+
+    velocity = (0, 0)
+    shooter_idx = 0
+
+
+@dataclass
+class BaselinePlayer:
+    centerx = 0
+    centery = 0
+    min_size = 1
+    max_size = 20
+    size = max_size
+    width = height = size
+    gesmol_speeed = 0.5
+    small = False
+    shot_timeout = 0
+    idx = 0
+
+    velocity = (0, 0)
+
+    walk_acc = 1000.0
+    max_speed = 250
+    slow_down = 4
+    shot_speed = 150
+    shot_delay_start = 1/5
+
+    key_up = None
+    key_down = None
+    key_left = None
+    key_right = None
+    key_shoot = None
+    key_small = None
+
+
+def baseline_shot(x, y, velocity, shooter_idx):
+    """A shot with what the first version set on every shot it fired."""
+    shot = BaselineShot()
+    shot.centerx = x
+    shot.centery = y
+    shot.shooter_idx = shooter_idx
+    shot.velocity = velocity
+    return shot
+
+
+def baseline_player(idx, keys):
+    """A moving player with what the first version set on every player."""
+    player = BaselinePlayer()
+    player.idx = idx
+    (player.key_up, player.key_down, player.key_left, player.key_right,
+     player.key_small, player.key_shoot) = keys
+    player.centerx, player.centery = 80.5, 160.5
+    player.velocity = (12.5, -3.5)
+    player.size = player.width = player.height = 19.5
+    player.shot_timeout = 0.1
+    return player
+
+
+def baseline_shot_frame(shots, delta):
+    """One frame of the shots of the first version, update_shot and draw_shot."""
+    window = pg.display.get_surface()
+    for shot in shots:
+        shot.centerx += shot.velocity[0] * delta
+        shot.centery += shot.velocity[1] * delta
+    for shot in shots:
+        pg.draw.rect(window, pg.Color(30, 30, 100), (shot.centerx - shot.size / 2,
+                                                     shot.centery - shot.size / 2,
+                                                     shot.size,
+                                                     shot.size))
+
+
+def gc_collections(step, frames):
+    """The collections of every GC generation per 1000 calls to step."""
+    gc.collect()
+    before = [stats["collections"] for stats in gc.get_stats()]
+    step()
+    after = [stats["collections"] for stats in gc.get_stats()]
+    return [(a - b) * 1000 / frames for a, b in zip(after, before)]
+
+
+def object_bytes(obj):
+    """The size of an object, and of its __dict__ if it has one."""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def object_and_values_bytes(obj):
+    """
+        The size of an object with its own floats and tuples of floats,
+        the values every instance of the first version had to itself.
+    """
+    size = object_bytes(obj)
+    for value in vars(obj).values():
+        if isinstance(value, tuple):
+            size += sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value
+                                               if isinstance(v, float))
+        elif isinstance(value, float):
+            size += sys.getsizeof(value)
+    return size
+
+
+def bench_memory(frames):
+    """
+        Prints the bytes per player and shot, and how often the GC runs,
+        in the scenarios and for the shots of the first version.
+    """
+    old_shot_bytes = object_and_values_bytes(baseline_shot(1.5, 2.5, (3.5, 4.5), 1))
+    old_player_bytes = object_and_values_bytes(baseline_player(1, game.KEYS[0]))
+
+    pool = game.ShotPool()
+    pool.add(1.5, 2.5, (3.5, 4.5), 1)
+    row_bytes = sum(getattr(pool, name)[0].nbytes for name in pool.ARRAYS)
+
+    players = game.PlayerPool()
+    players.add(1)
+    player_bytes = sum(getattr(players, name)[0].nbytes for name in players.ARRAYS)
+    print(f"player in pool:  {player_bytes:5} bytes per row, "
+          f"+{object_bytes(players[0])} for the Player")
+    print(f"baseline player: {old_player_bytes:5} bytes, one object with its values")
+    print(f"shot in pool:    {row_bytes:5} bytes per row, "
+          f"+{object_bytes(pool[0])} once per row if looked at as a Shot")
+    print(f"baseline shot:   {old_shot_bytes:5} bytes, one object with its values")
+
+    start_pygame()
+    print(f"{'scenario':>10} {'gen 0':>7} {'gen 1':>7} {'gen 2':>7}   (collections per 1000 frames)")
+    for name in SCENARIOS:
+        collections = gc_collections(lambda: run_scenario(name, frames), frames)
+        print(f"{name:>10} " + " ".join(f"{count:7.1f}" for count in collections))
+
+    # The shots of the crowded scenario, moved and drawn like the first version did.
+    rng = random.Random(0)
+    old_shots = [baseline_shot(rng.uniform(0, 400), rng.uniform(0, 400), (5.0, 0.0), 3 + i % 2)
+                 for i in range(2000)]
+    def old_frames():
+        for _ in range(frames):
+            baseline_shot_frame(old_shots, SIM_DELTA)
+    collections = gc_collections(old_frames, frames)
+    print(f"{'baseline':>10} " + " ".join(f"{count:7.1f}" for count in collections) +
+          "   (2000 shot objects, moved and drawn)")
+    pg.quit()
+
+
+#
+# Snapshots
+#
+
+def bench_snapshots(counts=(0, 100, 1000, 10000, 50000), frames=200):
+    """Time to save the game into a SnapshotRing and restore it, by live shots."""
+    ribs.HEADLESS = True
+    updater = game.update()
+    next(updater)
+    print(f"{'shots':>8} {'save us':>10} {'restore us':>11} {'kB':>8}")
+    for count in counts:
+        game.shots.clear()
+        rng = random.Random(count)
+        for _ in range(count):
+            game.shots.add(rng.uniform(0, 400), rng.uniform(0, 400), (1, 0), rng.choice((1, 2)))
+        ring = snapshots.SnapshotRing(60)
+        # Go round the ring once, so every snapshot is made before timing.
+        for frame in range(len(ring)):
+            ring.save(frame)
+        saves = time_frames(lambda: ring.save(frame), lambda: None, frames)
+        restores = time_frames(lambda: ring.restore(frame), lambda: None, frames)
+        size = len(bytes(ring.snapshots[0])) / 1000
+        print(f"{count:8} {saves * 1000:10.1f} {restores * 1000:11.1f} {size:8.0f}")
+    ribs.HEADLESS = False
+
+
+#
+# Training arenas
+#
+
+def bench_arenas(counts=(1, 64, 1024, 4096), steps=200):
+    """Environment steps per second of Arenas, with random actions."""
+    print(f"{'arenas':>8} {'ms/step':>10} {'env steps/s':>12}")
+    for count in counts:
+        env = arenas.Arenas(count)
+        env.reset()
+        rng = np.random.default_rng(count)
+        actions = rng.uniform(-1, 1, (steps, count, env.players, env.ACTIONS))
+        start = perf_counter()
+        for step in range(steps):
+            env.step(actions[step])
+        elapsed = perf_counter() - start
+        print(f"{count:8} {elapsed / steps * 1000:10.2f} {count * steps / elapsed:12.0f}")
+
+
+#
+# Drawing
+#
+
+def draw_per_call(centers, sizes, color):
+    """The original drawing code, one pg.draw.rect per square."""
+    window = pg.display.get_surface()
+    for x, y, size in zip(centers[:, 0].tolist(), centers[:, 1].tolist(), sizes.tolist()):
+        mark_dirty(pg.draw.rect(window, color, (x - size / 2, y - size / 2, size, size)))
+
+
+def bench_drawing(counts=(100, 1000, 10000, 50000, 200000), frames=10):
+    """
+        Time to draw shots with one pg.draw.rect each, blitted in one go
+        and written straight into the pixels, and checks that all three
+        draw exactly the same.
+    """
+    start_pygame()
+    window = pg.display.get_surface()
+    width, height = window.get_size()
+    print(f"{'squares':>8} {'per call ms':>12} {'blits ms':>10} {'pixels ms':>10} {'same':>5}")
+    pixel_squares = ribs.PIXEL_SQUARES
+    for count in counts:
+        rng = np.random.default_rng(count)
+        # Some squares partly off the screen, and players' odd sizes.
+        centers = rng.uniform(-10, (width + 10, height + 10), (count, 2))
+        sizes = rng.choice((game.ShotPool.shot_size, 1.5, 7.3, 20.0), count)
+        color = game.SHOT_COLOR
+
+        images = []
+        times = []
+        for limit in (None, math.inf, 0):
+            if limit is None:
+                draw = lambda: draw_per_call(centers, sizes, color)
+            else:
+                ribs.PIXEL_SQUARES = limit
+                draw = lambda: draw_squares(centers, sizes, color)
+            times.append(time_frames(draw, lambda: window.fill((0, 0, 0)), frames))
+            ribs.DIRTY_RECTS.clear()
+            images.append(pg.image.tobytes(window, "RGB"))
+        ribs.PIXEL_SQUARES = pixel_squares
+        same = images[0] == images[1] == images[2]
+        print(f"{count:8} {times[0]:12.2f} {times[1]:10.2f} {times[2]:10.2f} {str(same):>5}")
+
+
+def compare(report, baseline, tolerance, noise=0.05):
+    """
+        Prints every time that got slower than the baseline by more than
+        tolerance (and more than noise milliseconds). Returns True if
+        nothing did.
+    """
+    ok = True
+    for name, result in report.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        times = [("frame", result["frame ms"]["mean"], old["frame ms"]["mean"])]
+        times += [(phase, result["phase ms"][phase], old["phase ms"][phase])
+                  for phase in PHASES if phase in old["phase ms"]]
+        for what, new_ms, old_ms in times:
+            if new_ms > old_ms * (1 + tolerance) and new_ms - old_ms > noise:
+                print(f"SLOWER: {name} {what} {old_ms:.3f} ms -> {new_ms:.3f} ms")
+                ok = False
+    if ok:
+        print(f"No regressions against the baseline (tolerance {tolerance:.0%}).")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("suite", nargs="?", default="frames",
+                        choices=("frames", "collisions", "memory", "snapshots", "arenas",
+                                 "drawing"))
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="only run this scenario, can be given more than once")
+    parser.add_argument("--frames", type=int, default=600,
+                        help="frames to play per scenario")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="compare against a report written with --json")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="how much slower than the baseline is a regression")
+    args = parser.parse_args()
+
+    if args.suite == "collisions":
+        bench_collisions()
+        sys.exit()
+    if args.suite == "memory":
+        bench_memory(args.frames)
+        sys.exit()
+    if args.suite == "snapshots":
+        bench_snapshots()
+        sys.exit()
+    if args.suite == "arenas":
+        bench_arenas()
+        sys.exit()
+    if args.suite == "drawing":
+        bench_drawing()
+        sys.exit()
+
+    report = bench_frames(args.scenario or list(SCENARIOS), args.frames)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.tolerance):
+            sys.exit(1)
@@ -1,12 +1,28 @@
 import sys
 import math
+import argparse
 
+import numpy as np
 from ribs import *
-from dataclasses import dataclass
 
-# Asset dictionary for holding all your assets.
-assets = {}
-shots = []
+# All the assets of the game, loaded in the background by init.
+assets = Assets({
+    "teapot": "teapot.png",
+    "plong": "plong.wav",
+})
+# Kills per player idx, and the latest kills as (time, shooter_idx, victim_idx).
+scores = {}
+kill_feed = []
+# True when someone was hit, the next step starts a new round.
+new_round = True
+KILL_FEED_LENGTH = 4
+KILL_FEED_SECONDS = 5
+# The most scores shown, the best ones first.
+HUD_SCORES = 8
+# The scores are in the top right corner of the screen and the kills in
+# the bottom left, this far from the edges. A score is this wide.
+HUD_MARGIN = 10
+HUD_SCORE_WIDTH = 80
 
 def vec_len(v):
     return math.sqrt(v[0] ** 2 + v[1] ** 2)
@@ -14,114 +30,777 @@ def vec_len(v):
 def clamp(val, low, high):
     return min(max(val, low), high)
 
-@dataclass
 class Shot:
-    centerx = 0
-    centery = 0
-    size = 10
+    """
+        One shot in a ShotPool, as an object. It has centerx, centery, width
+        and height, so it works with the collision functions in ribs. The
+        pool hands out the same Shot for a row every time instead of making
+        new ones, so don't keep it around after the shot is removed.
+    """
+    __slots__ = ("pool", "index")
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+
+    @property
+    def centerx(self):
+        return self.pool.position[self.index, 0]
+
+    @centerx.setter
+    def centerx(self, value):
+        self.pool.position[self.index, 0] = value
+
+    @property
+    def centery(self):
+        return self.pool.position[self.index, 1]
+
+    @centery.setter
+    def centery(self, value):
+        self.pool.position[self.index, 1] = value
+
+    @property
+    def velocity(self):
+        return tuple(self.pool.velocity[self.index].tolist())
+
+    @velocity.setter
+    def velocity(self, value):
+        self.pool.velocity[self.index] = value
+
+    @property
+    def size(self):
+        return self.pool.size[self.index]
+
     width = height = size
-    
-    velocity = (0, 0)
-    shooter_idx = 0
-
-def update_shot(shot, delta):
-    shot.centerx += shot.velocity[0] * delta
-    shot.centery += shot.velocity[1] * delta
-    return True
-
-def draw_shot(shot):
-    window = pg.display.get_surface()
-    pg.draw.rect(window, pg.Color(30, 30, 100), (shot.centerx - shot.size / 2,
-                                                 shot.centery - shot.size / 2,
-                                                 shot.size,
-                                                 shot.size))
-
-@dataclass
+
+    @property
+    def shooter_idx(self):
+        return int(self.pool.shooter_idx[self.index])
+
+
+class ShotPool:
+    """
+        All the shots in the game. Instead of one object per shot, every
+        attribute is a numpy array with one row per shot, so all the shots
+        can be moved at once. Only the first len(pool) rows are live shots.
+
+        The pool also counts the live shots of every shooter, how many shots
+        have been fired, and how many have been culled for hitting a wall,
+        leaving the level or getting too old.
+    """
+    shot_size = 10
+    ARRAYS = ("position", "last_position", "velocity", "size", "shooter_idx", "time_left")
+
+    def __init__(self, capacity=256):
+        self.count = 0
+        self.fired = 0
+        self.culled = 0
+        # Live shots of every shooter_idx, grown when a bigger one shows up.
+        self.per_shooter = np.zeros(16, dtype=int)
+        self.handles = []
+        self.position = np.zeros((capacity, 2))
+        # Where the shots were the step before, to draw between the two.
+        self.last_position = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.size = np.zeros(capacity)
+        self.shooter_idx = np.zeros(capacity, dtype=int)
+        self.time_left = np.zeros(capacity)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """The shot at index as a Shot, reusing the one made last time."""
+        if not 0 <= index < self.count:
+            raise IndexError("shot index out of range")
+        while len(self.handles) <= index:
+            self.handles.append(Shot(self, len(self.handles)))
+        return self.handles[index]
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def _grow(self):
+        """Internal function, doubles the capacity and keeps the live shots."""
+        capacity = 2 * len(self.size)
+        for name in self.ARRAYS:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, centerx, centery, velocity, shooter_idx, size=shot_size,
+            lifetime=math.inf):
+        """Adds a shot that disappears after lifetime seconds, and returns its index."""
+        if self.count == len(self.size):
+            self._grow()
+        i = self.count
+        self.position[i] = centerx, centery
+        self.last_position[i] = centerx, centery
+        self.velocity[i] = velocity
+        self.size[i] = size
+        self.shooter_idx[i] = shooter_idx
+        self.time_left[i] = lifetime
+        self.count += 1
+        self.fired += 1
+        self._count_shooters(shooter_idx)
+        self.per_shooter[shooter_idx] += 1
+        return i
+
+    def add_many(self, centers, velocities, shooter_idx, size=shot_size, lifetime=math.inf):
+        """
+            Like add, but for arrays with one row per shot, the shots are
+            added in order.
+        """
+        count = len(shooter_idx)
+        while self.count + count > len(self.size):
+            self._grow()
+        rows = slice(self.count, self.count + count)
+        self.position[rows] = centers
+        self.last_position[rows] = centers
+        self.velocity[rows] = velocities
+        self.size[rows] = size
+        self.shooter_idx[rows] = shooter_idx
+        self.time_left[rows] = lifetime
+        self.count += count
+        self.fired += count
+        if count:
+            self._count_shooters(shooter_idx.max())
+            np.add.at(self.per_shooter, shooter_idx, 1)
+
+    def _count_shooters(self, shooter_idx):
+        """Internal function, makes room in per_shooter for shooter_idx."""
+        if shooter_idx >= len(self.per_shooter):
+            grown = np.zeros(2 * shooter_idx + 1, dtype=int)
+            grown[:len(self.per_shooter)] = self.per_shooter
+            self.per_shooter = grown
+
+    def live(self, shooter_idx):
+        """
+            The number of live shots fired by shooter_idx, or by every
+            shooter in an array of them.
+        """
+        known = np.asarray(shooter_idx) < len(self.per_shooter)
+        live = np.where(known, self.per_shooter[np.where(known, shooter_idx, 0)], 0)
+        return live if live.ndim else int(live)
+
+    def remove(self, indices):
+        """
+            Removes the shots at indices by moving live shots from the end
+            into the holes they leave, so the order of the shots changes.
+        """
+        indices = np.unique(indices)
+        if not len(indices):
+            return
+        np.subtract.at(self.per_shooter, self.shooter_idx[indices], 1)
+
+        new_count = self.count - len(indices)
+        dead = np.zeros(self.count - new_count, dtype=bool)
+        tail = indices[indices >= new_count]
+        dead[tail - new_count] = True
+        holes = indices[indices < new_count]
+        fillers = np.arange(new_count, self.count)[~dead]
+        for name in self.ARRAYS:
+            arr = getattr(self, name)
+            arr[holes] = arr[fillers]
+        self.count = new_count
+
+    def clear(self):
+        """Removes all shots, but keeps the memory around."""
+        self.count = 0
+        self.per_shooter[:] = 0
+
+
+shots = ShotPool()
+
+def _fast(move, limit):
+    """Internal function, which moves are longer than limit along x or y."""
+    return (np.abs(move[:, 0]) > limit) | (np.abs(move[:, 1]) > limit)
+
+def update_shots(pool, delta, walls):
+    """
+        Moves all shots, and culls the ones that hit a wall, left the level
+        or ran out of time. Shots that move more than half a tile in a step
+        are swept, so they hit walls they would jump over.
+    """
+    n = len(pool)
+    if not n:
+        return
+    pool.last_position[:n] = pool.position[:n]
+    move = pool.velocity[:n] * delta
+    pool.position[:n] += move
+    pool.time_left[:n] -= delta
+
+    dead = walls.blocked(pool.position[:n], pool.size[:n]) | (pool.time_left[:n] <= 0)
+    # Shots fast enough to jump over a wall between two steps are swept.
+    fast = np.flatnonzero(_fast(move, walls.grid_size / 2))
+    if len(fast):
+        times, _ = walls.sweep(pool.last_position[fast], pool.size[fast], move[fast])
+        dead[fast] |= times <= 1
+    culled = np.flatnonzero(dead)
+    pool.remove(culled)
+    pool.culled += len(culled)
+
+def _on_screen(pool, alpha, camera):
+    """
+        Internal function, the positions on the screen and sizes of the
+        bodies in pool the camera sees, between the last two steps.
+    """
+    n = len(pool)
+    position = pool.last_position[:n] + (pool.position[:n] - pool.last_position[:n]) * alpha
+    size = pool.size[:n]
+    if camera is not None:
+        seen = camera.visible(position, size)
+        position = position[seen] - camera.position
+        size = size[seen]
+    return position, size
+
+SHOT_COLOR = pg.Color(30, 30, 100)
+
+def draw_shots(pool, alpha=1.0, camera=None):
+    position, size = _on_screen(pool, alpha, camera)
+    draw_squares(position, size, SHOT_COLOR)
+
+def _column(name, axis=None):
+    """Internal function, a property for one row of a PlayerPool array."""
+    row = (lambda player: player.index) if axis is None else \
+        (lambda player: (player.index, axis))
+
+    def get(player):
+        return getattr(player.pool, name)[row(player)].item()
+
+    def set(player, value):
+        getattr(player.pool, name)[row(player)] = value
+
+    return property(get, set)
+
 class Player:
-    centerx = 0
-    centery = 0
+    """
+        One player in a PlayerPool. Like a Shot, the numbers that change
+        during a match live in the arrays of the pool and are only looked at
+        through the player, the keys and the tuning below live here.
+    """
+    __slots__ = ("pool", "index",
+                 "key_up", "key_down", "key_left", "key_right", "key_shoot", "key_small",
+                 "actions")
+
     min_size = 1
     max_size = 20
-    size = max_size
-    width = height = size
     gesmol_speeed = 0.5
-    small = False
-    shot_timeout = 0
-    idx = 0
-
-    velocity = (0, 0)
 
     walk_acc = 1000.0
     max_speed = 250
     slow_down = 4
     shot_speed = 150
     shot_delay_start = 1/5
+    # Seconds before a shot disappears by itself, None lets it live forever.
+    shot_lifetime = None
+    # The most shots the player can have in the air at once.
+    max_shots = 100
+
+    def __init__(self, pool, index):
+        self.pool: PlayerPool = pool
+        self.index: int = index
+
+        self.key_up: str = None
+        self.key_down: str = None
+        self.key_left: str = None
+        self.key_right: str = None
+        self.key_shoot: str = None
+        self.key_small: str = None
+        # The keys above as Bindings, made by bind_keys once they are set.
+        self.actions: Bindings = None
+
+    idx = _column("idx")
+    centerx = _column("position", 0)
+    centery = _column("position", 1)
+    # Where the player was the step before, to draw between the two.
+    last_centerx = _column("last_position", 0)
+    last_centery = _column("last_position", 1)
+    size = _column("size")
+    width = height = size
+    small = _column("small")
+    shot_timeout = _column("shot_timeout")
+
+    @property
+    def velocity(self):
+        return tuple(self.pool.velocity[self.index].tolist())
+
+    @velocity.setter
+    def velocity(self, value):
+        self.pool.velocity[self.index] = value
+
+
+class PlayerPool:
+    """
+        All the players in the game, stored like the ShotPool with one row
+        per player in every array, so all players can be moved at once.
+        Indexing it gives the Player of a row.
+
+        What every player wants to do this step is in move (a direction
+        in x and y, -1 to 1), shoot and toggle_small. read_input fills them
+        from the keyboard, for the players that have keys, anything else,
+        like a bot, can write them directly.
+    """
+    ARRAYS = ("position", "last_position", "velocity", "size", "small", "shot_timeout",
+              "idx", "move", "shoot", "toggle_small")
+
+    def __init__(self, capacity=2):
+        self.count = 0
+        self.players = []
+        self.position = np.zeros((capacity, 2))
+        self.last_position = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.size = np.zeros(capacity)
+        self.small = np.zeros(capacity, dtype=bool)
+        self.shot_timeout = np.zeros(capacity)
+        self.idx = np.zeros(capacity, dtype=int)
+        self.move = np.zeros((capacity, 2))
+        self.shoot = np.zeros(capacity, dtype=bool)
+        self.toggle_small = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError("player index out of range")
+        return self.players[index]
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.players[index]
+
+    def _grow(self):
+        """Internal function, doubles the capacity and keeps the players."""
+        capacity = 2 * len(self.size)
+        for name in self.ARRAYS:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, idx):
+        """Adds a player with the number idx, standing still at (0, 0), and returns it."""
+        if self.count == len(self.size):
+            self._grow()
+        i = self.count
+        for name in self.ARRAYS:
+            getattr(self, name)[i] = 0
+        self.idx[i] = idx
+        self.size[i] = Player.max_size
+        if i == len(self.players):
+            self.players.append(Player(self, i))
+        else:
+            self.players[i].__init__(self, i)
+        self.count += 1
+        return self.players[i]
+
+    def clear(self):
+        """Removes all players, but keeps the memory around."""
+        self.count = 0
+
+
+players = PlayerPool()
+
+def bind_keys(player):
+    """Turns the keys of the player into Bindings, call it when the keys change."""
+    player.actions = Bindings(up=player.key_up, down=player.key_down,
+                              left=player.key_left, right=player.key_right,
+                              shoot=player.key_shoot, small=player.key_small)
+
+def spawn(pool, starts):
+    """
+        Puts every player on a start, in order. With more players than
+        starts, the starts are handed out again from the first one.
+    """
+    if not starts:
+        raise ValueError("The level has no start tiles (S)")
+    n = len(pool)
+    starts = np.asarray(starts, dtype=float)
+    pool.position[:n] = starts[np.arange(n) % len(starts)]
+    pool.last_position[:n] = pool.position[:n]
+
+def read_input(pool):
+    """Fills in what the players with keys want to do, from the keys held."""
+    for player in pool:
+        actions = player.actions
+        if actions is None:
+            continue
+        actions.update()
+        i = player.index
+        pool.move[i] = (actions.down("right") - actions.down("left"),
+                        actions.down("down") - actions.down("up"))
+        pool.shoot[i] = actions.down("shoot")
+        pool.toggle_small[i] = actions.pressed("small")
+
+def bot_input(pool, rng, chase=0.7):
+    """
+        Plays every player with a very simple bot. Most steps it runs
+        towards the closest other player, the rest it runs in a random
+        direction, and it always holds shoot. Shots fly the way the player
+        moves, so running at someone is also aiming at them. rng is a numpy
+        Generator, so a seed gives the same bots every time.
+    """
+    n = len(pool)
+    position = pool.position[:n]
+    wander = rng.integers(-1, 2, size=(n, 2))
+    if n > 1:
+        # From every player (rows) to every other player (columns).
+        to_other = position[None, :, :] - position[:, None, :]
+        distance = (to_other ** 2).sum(axis=2)
+        np.fill_diagonal(distance, np.inf)
+        closest = distance.argmin(axis=1)
+        towards = np.sign(to_other[np.arange(n), closest])
+        pool.move[:n] = np.where(rng.random((n, 1)) < chase, towards, wander)
+    else:
+        pool.move[:n] = wander
+    pool.shoot[:n] = True
 
-    key_up = None
-    key_down = None
-    key_left = None
-    key_right = None
-    key_shoot = None
-    key_small = None
-
-def update_player(player, delta):
-    dx, dy = (0, 0)
-    if key_down(player.key_left):
-        dx -= 1
-    if key_down(player.key_right):
-        dx += 1
-    if key_down(player.key_up):
-        dy -= 1
-    if key_down(player.key_down):
-        dy += 1
-
-    player.velocity = (player.velocity[0] + (dx * player.walk_acc * delta),
-                       player.velocity[1] + (dy * player.walk_acc * delta))
+def update_players(pool, delta, shot_pool):
+    """
+        Moves, shrinks and grows all players at once, and fires the shots
+        of the ones that want to and can into shot_pool.
+    """
+    n = len(pool)
+    if not n:
+        return
+    position = pool.position[:n]
+    velocity = pool.velocity[:n]
+    pool.last_position[:n] = position
 
+    velocity += pool.move[:n] * Player.walk_acc * delta
     # ** delta ?
-    player.velocity = (player.velocity[0] + player.velocity[0] * -player.slow_down * delta,
-                       player.velocity[1] + player.velocity[1] * -player.slow_down * delta)
-
-    if (speed := vec_len(player.velocity)) > player.max_speed:
-        player.velocity = ((player.velocity[0] * (player.max_speed / speed)),
-                           (player.velocity[1] * (player.max_speed / speed)))
-
-    player.centerx += player.velocity[0] * delta
-    player.centery += player.velocity[1] * delta
-
-    if key_pressed(player.key_small):
-        player.small = not player.small
-
-    if player.shot_timeout > 0:
-        player.shot_timeout -= delta
-        if player.shot_timeout < 0:
-            player.shot_timeout = 0
-
-    if key_down(player.key_shoot) and player.shot_timeout == 0:
-        # shoot
-        player_speed = vec_len(player.velocity)
-        if player_speed != 0:
-            shot = Shot()
-            shot.centerx = player.centerx
-            shot.centery = player.centery
-            shot.shooter_idx = player.idx
-            shot.velocity = (player.velocity[0] * (player.shot_speed / player_speed),
-                             player.velocity[1] * (player.shot_speed / player_speed))
-            shots.append(shot)
-            player.shot_timeout = player.shot_delay_start
-
-    if player.small and player.size > player.min_size:
-        player.size -= player.gesmol_speeed
-    elif not player.small and player.size < player.max_size:
-        player.size += player.gesmol_speeed
-    player.width = player.height = player.size
-
-def draw_player(player):
-    window = pg.display.get_surface()
-    pg.draw.rect(window, pg.Color(100, 30, 30), (player.centerx - player.size / 2,
-                                                 player.centery - player.size / 2,
-                                                 player.size,
-                                                 player.size))
+    velocity += velocity * -Player.slow_down * delta
+    speed = np.sqrt(velocity[:, 0] ** 2 + velocity[:, 1] ** 2)
+    fast = speed > Player.max_speed
+    velocity[fast] *= (Player.max_speed / speed[fast])[:, None]
+    position += velocity * delta
+
+    small = pool.small[:n]
+    small ^= pool.toggle_small[:n]
+
+    shot_timeout = pool.shot_timeout[:n]
+    counting = shot_timeout > 0
+    shot_timeout[counting] = np.maximum(shot_timeout[counting] - delta, 0)
+
+    firing = np.flatnonzero(pool.shoot[:n] & (shot_timeout == 0))
+    if len(firing):
+        idx = pool.idx[firing]
+        speed = np.sqrt(velocity[firing, 0] ** 2 + velocity[firing, 1] ** 2)
+        # Standing still shoots nothing.
+        able = (speed != 0) & (shot_pool.live(idx) < Player.max_shots)
+        firing, idx, speed = firing[able], idx[able], speed[able]
+        lifetime = math.inf if Player.shot_lifetime is None else Player.shot_lifetime
+        shot_pool.add_many(position[firing],
+                           velocity[firing] * (Player.shot_speed / speed)[:, None],
+                           idx,
+                           lifetime=lifetime)
+        shot_timeout[firing] = Player.shot_delay_start
+
+    size = pool.size[:n]
+    size[small & (size > Player.min_size)] -= Player.gesmol_speeed
+    size[~small & (size < Player.max_size)] += Player.gesmol_speeed
+
+PLAYER_COLOR = pg.Color(100, 30, 30)
+
+def draw_players(pool, alpha=1.0, camera=None):
+    position, size = _on_screen(pool, alpha, camera)
+    draw_squares(position, size, PLAYER_COLOR)
+
+def _swept_pairs(position, size, last_position, a, b):
+    """
+        Internal function, adds the pairs of bodies that touched on the way
+        to the pairs a, b that overlap, if at least one of them moved more
+        than half its size since the last step. Without this, small fast
+        players can walk straight through shots.
+    """
+    move = position - last_position
+    fast = _fast(move, size / 2)
+    if not fast.any():
+        return a, b
+    # The boxes around where the bodies were and are, to find the pairs
+    # that could have touched.
+    low = np.minimum(position, last_position) - (size / 2)[:, None]
+    high = np.maximum(position, last_position) + (size / 2)[:, None]
+    middle = (low + high) / 2
+    swept_a, swept_b = overlapping_pairs(middle[:, 0], middle[:, 1],
+                                         high[:, 0] - low[:, 0], high[:, 1] - low[:, 1])
+    new = (fast[swept_a] | fast[swept_b]) & ~np.isin(
+        np.minimum(swept_a, swept_b) * len(size) + np.maximum(swept_a, swept_b),
+        np.minimum(a, b) * len(size) + np.maximum(a, b))
+    swept_a, swept_b = swept_a[new], swept_b[new]
+    box = np.repeat(size[:, None], 2, axis=1)
+    times, _ = sweep_many(last_position[swept_a], box[swept_a], move[swept_a],
+                          last_position[swept_b], box[swept_b], move[swept_b])
+    touched = times <= 1
+    return np.concatenate((a, swept_a[touched])), np.concatenate((b, swept_b[touched]))
+
+def shot_hits(pool, players):
+    """
+        Removes shots that hit a shot from another player, and returns two
+        arrays, the rows in players that were hit by an enemy shot and the
+        shooter_idx of that shot, ordered by player and then by shooter.
+        A player hit by several shots from the same shooter in one step
+        is only in there once, it's one kill.
+    """
+    n = len(pool)
+    m = len(players)
+    if not n:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    shooter_idx = pool.shooter_idx[:n]
+
+    # The shots and the players are all found in one go, the first n
+    # bodies are shots and the rest are players.
+    position = np.concatenate((pool.position[:n], players.position[:m]))
+    size = np.concatenate((pool.size[:n], players.size[:m]))
+    a, b = overlapping_pairs(position[:, 0], position[:, 1], size, size)
+    a, b = _swept_pairs(position, size, np.concatenate((pool.last_position[:n],
+                                                        players.last_position[:m])), a, b)
+    shot, other = np.minimum(a, b), np.maximum(a, b)
+
+    shot_a, shot_b = shot[other < n], other[other < n]
+    enemies = shooter_idx[shot_a] != shooter_idx[shot_b]
+
+    player_shot = (shot < n) & (other >= n)
+    victim = other[player_shot] - n
+    shot = shot[player_shot]
+    enemy = shooter_idx[shot] != players.idx[victim]
+    victim, shot = victim[enemy], shot[enemy]
+    shooter = shooter_idx[shot]
+    order = np.lexsort((shooter, victim))
+    victim, shooter = victim[order], shooter[order]
+    # Only the first hit of every (victim, shooter) pair counts.
+    first = np.ones(len(victim), dtype=bool)
+    first[1:] = (victim[1:] != victim[:-1]) | (shooter[1:] != shooter[:-1])
+    victim, shooter = victim[first], shooter[first]
+
+    pool.remove(np.concatenate((shot_a[enemies], shot_b[enemies])))
+    return victim, shooter
+
+def collide_shots(pool, players):
+    """
+        Removes shots that hit a shot from another player, and returns
+        (player, shooter_idx) for every player hit by an enemy, once per
+        shooter.
+    """
+    victims, shooters = shot_hits(pool, players)
+    return [(players[row], shooter) for row, shooter in
+            zip(victims.tolist(), shooters.tolist())]
+
+class WallGrid:
+    """
+        The walls of a level, along with which wall covers every tile, so
+        the walls close to a body can be found without looking at them all.
+        Iterating over it gives the wall rects.
+
+        With merge, runs of wall tiles are joined into larger rects, first
+        along rows and then rows with the same run on top of eachother.
+        Fewer rects are faster to draw and to solve, but bodies slide
+        differently along them: with a rect per tile, a player sliding
+        along a wall catches on the seams between tiles, and on a merged
+        wall it doesn't. The game plays on tiles, merging is for drawing
+        and for bots that don't care.
+    """
+
+    def __init__(self, solid, grid_size, merge=False, origin=(0, 0)):
+        self.grid_size = grid_size
+        # Where the top left tile is in the world, for grids over part of
+        # a bigger level.
+        self.origin = np.array(origin, dtype=float)
+        origin_x, origin_y = origin
+        self.rects = []
+        self.tile_wall = np.full(solid.shape, -1)
+
+        # The merged rect above every run, keyed on (first, end) tile.
+        above = {}
+        for tile_y, row in enumerate(solid):
+            runs = {}
+            tile_x = 0
+            while tile_x < len(row):
+                if not row[tile_x]:
+                    tile_x += 1
+                    continue
+                end = tile_x + 1
+                while merge and end < len(row) and row[end]:
+                    end += 1
+                wall = above.get((tile_x, end))
+                if wall is None:
+                    wall = len(self.rects)
+                    self.rects.append(pg.Rect(origin_x + tile_x * grid_size,
+                                              origin_y + tile_y * grid_size,
+                                              (end - tile_x) * grid_size, grid_size))
+                else:
+                    self.rects[wall].height += grid_size
+                self.tile_wall[tile_y, tile_x:end] = wall
+                runs[(tile_x, end)] = wall
+                tile_x = end
+            above = runs if merge else {}
+
+        self.centers = np.array([wall.center for wall in self.rects], dtype=float).reshape(-1, 2)
+        self.sizes = np.array([wall.size for wall in self.rects], dtype=float).reshape(-1, 2)
+
+    def __iter__(self):
+        return iter(self.rects)
+
+    def __len__(self):
+        return len(self.rects)
+
+    def _tile_walls(self, first, last):
+        """
+            Internal function, the wall on every tile from first to last,
+            numpy arrays of tiles, one row per box. The places left over,
+            and tiles outside the grid, are -1.
+        """
+        rows, cols = self.tile_wall.shape
+        span_x, span_y = (np.maximum((last - first).max(axis=0, initial=0), 0) + 1).tolist()
+        tiles_x = first[:, 0, None] + np.arange(span_x)
+        tiles_y = first[:, 1, None] + np.arange(span_y)
+        inside_x = (tiles_x <= last[:, 0, None]) & (tiles_x >= 0) & (tiles_x < cols)
+        inside_y = (tiles_y <= last[:, 1, None]) & (tiles_y >= 0) & (tiles_y < rows)
+        found = self.tile_wall[np.clip(tiles_y, 0, rows - 1)[:, :, None],
+                               np.clip(tiles_x, 0, cols - 1)[:, None, :]]
+        inside = inside_y[:, :, None] & inside_x[:, None, :]
+        return np.where(inside, found, -1).reshape(len(first), -1)
+
+    def blocked(self, centers, sizes):
+        """
+            Takes numpy arrays of square boxes, and returns True for every
+            box that touches a wall tile or is outside the level.
+        """
+        rows, cols = self.tile_wall.shape
+        half = (sizes / 2)[:, None]
+        centers = centers - self.origin
+        first = np.floor((centers - half) / self.grid_size).astype(int)
+        last = np.floor((centers + half) / self.grid_size).astype(int)
+        result = ((first < 0).any(axis=1) | (last[:, 0] >= cols) | (last[:, 1] >= rows))
+
+        first = np.clip(first, 0, (cols - 1, rows - 1))
+        last = np.clip(last, 0, (cols - 1, rows - 1))
+        if len(sizes) and sizes.max() > self.grid_size:
+            # Bigger boxes can cover walls between their corners.
+            return result | (self._tile_walls(first, last) >= 0).any(axis=1)
+        # Boxes no bigger than a tile only touch the tiles under their corners.
+        for tile_x in (first[:, 0], last[:, 0]):
+            for tile_y in (first[:, 1], last[:, 1]):
+                result |= self.tile_wall[tile_y, tile_x] >= 0
+        return result
+
+    def near(self, body, margin=1):
+        """
+            The indices of the walls on the tiles under body and margin
+            tiles around it, in order.
+        """
+        rows, cols = self.tile_wall.shape
+        size = self.grid_size
+        centerx, centery = body.centerx - self.origin[0], body.centery - self.origin[1]
+        min_x = max(int((centerx - body.width / 2) // size) - margin, 0)
+        min_y = max(int((centery - body.height / 2) // size) - margin, 0)
+        max_x = min(int((centerx + body.width / 2) // size) + margin + 1, cols)
+        max_y = min(int((centery + body.height / 2) // size) + margin + 1, rows)
+        found = self.tile_wall[min_y:max_y, min_x:max_x]
+        return np.unique(found[found >= 0])
+
+    def near_many(self, centers, sizes, margin=1):
+        """
+            Like near, but for numpy arrays of square boxes. Returns one
+            row per box with the indices of the walls in order, with -1 in
+            the places left over.
+        """
+        rows, cols = self.tile_wall.shape
+        half = (sizes / 2)[:, None]
+        centers = centers - self.origin
+        # floor_divide rounds just like // does in near.
+        first = np.maximum(np.floor_divide(centers - half, self.grid_size).astype(int) - margin, 0)
+        last = np.minimum(np.floor_divide(centers + half, self.grid_size).astype(int) + margin,
+                          (cols - 1, rows - 1))
+        found = np.sort(self._tile_walls(first, last), axis=1)
+        found[:, 1:][found[:, 1:] == found[:, :-1]] = -1
+        return found[:, (found >= 0).any(axis=0)]
+
+    def sweep(self, centers, sizes, moves):
+        """
+            Moves numpy arrays of square boxes in straight lines, and finds
+            the first wall every box touches on the way, see sweep_many.
+            Returns the time of impact and the normal of that wall, or
+            np.inf for boxes that don't touch one. Leaving the level isn't
+            touching a wall, blocked finds that.
+        """
+        n = len(centers)
+        rows, cols = self.tile_wall.shape
+        half = (sizes / 2)[:, None]
+        start = centers - self.origin
+        end = start + moves
+        # The tiles the boxes cover on the way.
+        first = np.floor_divide(np.minimum(start, end) - half, self.grid_size).astype(int)
+        last = np.floor_divide(np.maximum(start, end) + half, self.grid_size).astype(int)
+        first = np.clip(first, 0, (cols - 1, rows - 1))
+        last = np.clip(last, 0, (cols - 1, rows - 1))
+        found = np.sort(self._tile_walls(first, last), axis=1)
+        found[:, 1:][found[:, 1:] == found[:, :-1]] = -1
+        found = found[:, (found >= 0).any(axis=0)]
+        if not found.shape[1]:
+            return np.full(n, np.inf), np.zeros((n, 2))
+
+        box = np.repeat(sizes[:, None], 2, axis=1)
+        times, normals = sweep_many(centers[:, None], box[:, None], moves[:, None],
+                                    self.centers[found], self.sizes[found])
+        times[found < 0] = np.inf
+        best = times.argmin(axis=1)
+        rows = np.arange(n)
+        return times[rows, best], normals[rows, best]
+
+
+def sweep_walls(pool, walls, bounce=0.1):
+    """
+        Stops the players that moved more than half a tile since the last
+        step at the first wall on the way, so they can't jump through
+        walls. They keep moving along the wall, solve_walls does the rest.
+    """
+    n = len(pool)
+    move = pool.position[:n] - pool.last_position[:n]
+    fast = np.flatnonzero(_fast(move, walls.grid_size / 2))
+    if not len(fast):
+        return
+    times, normals = walls.sweep(pool.last_position[fast], pool.size[fast], move[fast])
+    hit = np.isfinite(times) & (normals != 0).any(axis=1)
+    fast, times, normals = fast[hit], times[hit], normals[hit]
+    contact = pool.last_position[fast] + move[fast] * times[:, None]
+    pool.position[fast] = np.where(normals != 0, contact, pool.position[fast])
+    velocity = pool.velocity[fast]
+    into = np.minimum((velocity * normals).sum(axis=1), 0)
+    pool.velocity[fast] = velocity - normals * ((1 + bounce) * into)[:, None]
+
+def solve_walls(pool, walls):
+    """
+        Pushes the players out of the walls close to them, one wall at a
+        time in order, for all players at once. Moves every player just
+        like calling solve_rect_overlap for every wall, but only the walls
+        the players touch are solved.
+    """
+    n = len(pool)
+    sweep_walls(pool, walls)
+    # Only the players on a tile with a wall can touch one, grown by a
+    # pixel to also find the ones just touching a wall.
+    rows = np.flatnonzero(walls.blocked(pool.position[:n], pool.size[:n] + 1))
+    if not len(rows):
+        return
+    center = pool.position[rows]
+    velocity = pool.velocity[rows]
+    size = np.repeat(pool.size[rows, None], 2, axis=1)
+    for wall in walls.near_many(center, pool.size[rows]).T:
+        new_center, _, new_velocity, _, hit = solve_many(center, size,
+                                                         walls.centers[wall],
+                                                         walls.sizes[wall],
+                                                         velocity,
+                                                         mass_b=0,
+                                                         bounce=0.1)
+        solved = ((wall >= 0) & hit)[:, None]
+        center = np.where(solved, new_center, center)
+        velocity = np.where(solved, new_velocity, velocity)
+    pool.position[rows] = center
+    pool.velocity[rows] = velocity
 
 # square
 LEVEL = \
@@ -138,117 +817,274 @@ LEVEL = \
 ##########
 """
 
-def parse_level(level_string):
-    GRID_SIZE = 40
+# The size of a tile in pixels.
+GRID_SIZE = 40
 
-    walls = []
+def level_tiles(level_string):
+    """
+        Reads a level, and returns which tiles are walls as a numpy array
+        of booleans, and the starts as a list of (tile_x, tile_y).
+    """
     starts = []
 
     level_lines = level_string.strip().split("\n")
+    solid = np.zeros((len(level_lines), max(map(len, level_lines))), dtype=bool)
     for tile_y, line in enumerate(level_lines):
-        y = tile_y * GRID_SIZE
         for tile_x, c in enumerate(line):
-            x = tile_x * GRID_SIZE
-            r = pg.Rect(x, y, GRID_SIZE, GRID_SIZE)
             if c == "#":
                 # It's a wall
-                walls.append(r)
+                solid[tile_y, tile_x] = True
             elif c == "S":
                 # It's the start
-                starts.append((x, y))
+                starts.append((tile_x, tile_y))
+    return solid, starts
+
+
+def parse_level(level_string, merge_walls=False):
+    solid, starts = level_tiles(level_string)
+    return (WallGrid(solid, GRID_SIZE, merge_walls),
+            [(x * GRID_SIZE, y * GRID_SIZE) for x, y in starts])
+
 
-    return walls, starts
+WALL_COLOR = pg.Color(100, 100, 100)
+
+def draw_walls(surface, walls, view):
+    """
+        Draws the walls of a WallGrid that are in view, a pg.Rect in the
+        world, on surface.
+    """
+    surface.fill(pg.Color(0, 0, 0))
+    for wall in walls.near(view, margin=0).tolist():
+        pg.draw.rect(surface, WALL_COLOR, walls.rects[wall].move(-view.x, -view.y))
 
 
 def init():
     """ A function for loading all your assets.
         (Audio assets can at their earliest be loaded here.)
     """
-    # Load images here
-    assets["teapot"] = pg.image.load("teapot.png")
+    # Starts loading everything in the manifest at the top, the game
+    # doesn't wait for it.
+    assets.load()
 
-    # Load sounds here
-    assets["plong"] = pg.mixer.Sound("plong.wav")
 
+# Which part of the level is on the screen, it follows the players.
+camera = Camera()
+# The player the camera always keeps on the screen, the one at this computer.
+CAMERA_FOCUS = 0
+# What the level is drawn on, the part of it in level_view.
+level_background = None
+level_view = None
+# The walls of a level string, ChunkedLevels draw themselves.
+level_walls = None
+
+# How many players there are, the first ones play with the keys below.
+PLAYER_COUNT = 2
+# The keys of the players at the keyboard, in the order up, down, left, right, small, shoot.
+KEYS = ("wsadfc", "ikjlhn")
 
 def update():
     """The program starts here"""
+    global new_round, level_background, level_view, level_walls
     # Initialization (only runs on start/restart)
-    player1 = Player()
-    player2 = Player()
-
-    walls, start = parse_level(LEVEL)
-
-    player1.idx = 1
-    player1.key_up = "w"
-    player1.key_down = "s"
-    player1.key_left = "a"
-    player1.key_right = "d"
-    player1.key_small = "f"
-    player1.key_shoot = "c"
-
-    player2.idx = 2
-    player2.key_up = "i"
-    player2.key_down = "k"
-    player2.key_left = "j"
-    player2.key_right = "l"
-    player2.key_small = "h"
-    player2.key_shoot = "n"
-
-    reset_players = True
+    players.clear()
+    scores.clear()
+    kill_feed.clear()
+
+    # LEVEL is a level string, or a levels.ChunkedLevel for big levels.
+    chunked = not isinstance(LEVEL, str)
+    if chunked:
+        start = LEVEL.starts
+        camera.bounds = LEVEL.size()
+        level_walls = None
+    else:
+        walls, start = parse_level(LEVEL)
+        camera.bounds = (walls.tile_wall.shape[1] * walls.grid_size,
+                         walls.tile_wall.shape[0] * walls.grid_size)
+        level_walls = walls
+    # The level is drawn on the background when the camera moves, in draw.
+    level_view = None
+    if not headless():
+        level_background = set_background(pg.Surface(tuple(camera.size().astype(int).tolist())))
+
+    for i in range(PLAYER_COUNT):
+        player = players.add(i + 1)
+        if i < len(KEYS):
+            (player.key_up, player.key_down, player.key_left, player.key_right,
+             player.key_small, player.key_shoot) = KEYS[i]
+            bind_keys(player)
+
+    new_round = True
     # Main update loop
     while True:
-        if reset_players:
-            reset_players = False
-            player1.centerx = start[0][0]
-            player1.centery = start[0][1]
-            player2.centerx = start[1][0]
-            player2.centery = start[1][1]
+        if new_round:
+            new_round = False
+            spawn(players, start)
             shots.clear()
+        if chunked:
+            with timed("level"):
+                walls = LEVEL.activate(players.position[:len(players)])
+
+        with timed("player update"):
+            read_input(players)
+            update_players(players, delta(), shots)
+
+        with timed("shot update"):
+            update_shots(shots, delta(), walls)
 
-        update_player(player1, delta())
-        update_player(player2, delta())
-
-        to_remove = []
-        for shot in shots:
-            if not update_shot(shot, delta()):
-                to_remove.append(shot)
-        for shot in to_remove:
-            shots.remove(shot)
-
-        draw_player(player1)
-        draw_player(player2)
-        for shot in shots:
-            draw_shot(shot)
-
-        for shot in shots:
-            for other in shots:
-                if shot.shooter_idx != other.shooter_idx:
-                    _, depth = overlap_data(shot, other)
-                    if depth > 0:
-                        to_remove.append(shot)
-            for player in (player1, player2):
-                _, depth = overlap_data(player, shot)
-                if depth > 0 and player.idx != shot.shooter_idx:
-                    print(f"{player.idx} ded by {shot.shooter_idx}")
-                    reset_players = True
-        for shot in to_remove:
-            shots.remove(shot)
-
-        for wall in walls:
-            window = pg.display.get_surface()
-            pg.draw.rect(window, pg.Color(100, 100, 100), wall)
-            for player in (player1, player2):
-                player.velocity, wall_vel, overlap = solve_rect_overlap(player,
-                                                                        wall,
-                                                                        player.velocity,
-                                                                        mass_b=0,
-                                                                        bounce=0.1)
+        with timed("collision"):
+            hits = collide_shots(shots, players)
+        for player, shooter_idx in hits:
+            scores[shooter_idx] = scores.get(shooter_idx, 0) + 1
+            kill_feed.append((time(), shooter_idx, player.idx))
+            new_round = True
+        kill_feed[:] = [kill for kill in kill_feed[-KILL_FEED_LENGTH:]
+                        if time() - kill[0] < KILL_FEED_SECONDS]
+
+        with timed("walls"):
+            solve_walls(players, walls)
+            if chunked:
+                LEVEL.keep_inside(players)
 
         # Main loop ends here, put your code above this line
         yield
 
 
+def draw():
+    """Draws everything, between the last two steps of update."""
+    global level_view
+    with timed("draw"):
+        camera.follow(players.position[:len(players)], focus=CAMERA_FOCUS)
+        view = camera.view()
+        # Nothing to draw before the first step has loaded the level.
+        if level_background is not None and view != level_view:
+            if level_walls is None:
+                LEVEL.draw(level_background, view)
+            else:
+                draw_walls(level_background, level_walls, view)
+            level_view = view
+            redraw_background()
+        draw_players(players, alpha(), camera)
+        draw_shots(shots, alpha(), camera)
+        draw_hud()
+
+
+def draw_hud():
+    """Draws the best scores and the latest kills in the corners of the screen."""
+    width, height = pg.display.get_surface().get_size()
+    best = sorted(players.idx[:len(players)].tolist(), key=lambda idx: -scores.get(idx, 0))
+    for i, idx in enumerate(best[:HUD_SCORES]):
+        draw_text(f"P{idx}: {scores.get(idx, 0)}",
+                  (width - HUD_MARGIN - HUD_SCORE_WIDTH, HUD_MARGIN + i * 24), size=24)
+    # The latest kill is at the bottom.
+    top = height - HUD_MARGIN - len(kill_feed) * 20
+    for i, (_, shooter_idx, victim_idx) in enumerate(kill_feed):
+        draw_text(f"Player {shooter_idx} shot player {victim_idx}", (HUD_MARGIN, top + i * 20),
+                  size=20)
+
+
+def main():
+    """Plays the game, with the options from the command line."""
+    global PLAYER_COUNT, LEVEL, CAMERA_FOCUS
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true",
+                        help="run without a window, as fast as possible")
+    parser.add_argument("--frames", type=int, default=None,
+                        help="stop after this many frames")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="save the time of every frame to a .csv or .json file")
+    parser.add_argument("--overlay", action="store_true",
+                        help="show frame times on the screen")
+    parser.add_argument("--capture", metavar="FILE",
+                        help="capture the frames to a video, a .raw file or images like %%05d.png")
+    parser.add_argument("--startup", action="store_true",
+                        help="print how long starting the game took")
+    parser.add_argument("--players", type=int, default=PLAYER_COUNT,
+                        help=f"how many players, the first {len(KEYS)} play with the keyboard")
+    parser.add_argument("--level", metavar="FILE",
+                        help="play a big level made with levels.py")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the match to a replay file")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play back a replay file instead of the keyboard")
+    parser.add_argument("--seek", type=float, default=0,
+                        help="with --replay, start this many seconds in")
+    parser.add_argument("--peer", metavar="HOST:PORT",
+                        help="play over the network against the game at HOST:PORT")
+    parser.add_argument("--port", type=int, default=47800,
+                        help="with --peer, the UDP port to listen on")
+    parser.add_argument("--slot", type=int, choices=(1, 2), default=1,
+                        help="with --peer, play as player 1 or 2 (the other side picks the other)")
+    parser.add_argument("--delay", type=int, default=2,
+                        help="with --peer, steps of input delay")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="with --peer, add this many seconds of latency, for testing")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="with --peer, seconds of jitter on top of --latency")
+    parser.add_argument("--loss", type=float, default=0,
+                        help="with --peer, share of packets to lose, for testing")
+    args = parser.parse_args()
+    PLAYER_COUNT = args.players
+    if args.profile or args.overlay:
+        start_profiling(overlay=args.overlay)
+
+    # Imported here, they import this file.
+    from replays import Recorder, Replay, level_digest
+    from levels import ChunkedLevel
+    import netplay
+    if args.level:
+        LEVEL = ChunkedLevel(args.level)
+    recorder = None
+    session = None
+    if args.peer:
+        host, _, port = args.peer.rpartition(":")
+        transport = netplay.UdpTransport(args.port, (host or "127.0.0.1", int(port)))
+        if args.latency or args.jitter or args.loss:
+            transport = netplay.SimulatedNetwork(transport, args.latency, args.jitter,
+                                                 args.loss)
+        PLAYER_COUNT = 2
+        CAMERA_FOCUS = args.slot - 1
+        session = netplay.Rollback(transport, args.slot - 1, delay=args.delay)
+        set_input_hook(session)
+    elif args.replay:
+        replay = Replay(args.replay)
+        PLAYER_COUNT = replay.players
+        if replay.level_path and not args.level:
+            LEVEL = ChunkedLevel(replay.level_path)
+        if level_digest(LEVEL) != replay.level_digest:
+            parser.error(f"{args.replay} was recorded on another level")
+        if args.seek:
+            replay.seek(round(args.seek / replay.delta))
+        set_input_hook(replay)
+    elif args.record:
+        recorder = Recorder(args.record)
+        set_input_hook(recorder)
+
+    if args.capture:
+        start_capture(args.capture)
+    start_game(init, update, headless=args.headless, max_frames=args.frames, draw=draw)
+    if args.capture:
+        capture = stop_capture()
+        print(f"Captured {capture['written']} of {capture['frames']} frames "
+              f"({capture['width']}x{capture['height']}) to {capture['path']}, "
+              f"dropped {capture['dropped']}")
+    if recorder:
+        recorder.close()
+    if session:
+        session.linger()
+        session.transport.close()
+        print(", ".join(f"{name} {value:.3f}" if isinstance(value, float) else
+                        f"{name} {value}" for name, value in session.stats().items()))
+    if args.startup:
+        assets.wait()
+        print(startup_report())
+    if args.profile:
+        save_profile(args.profile)
+        print("work ms percentiles:", frame_percentiles())
+
+
 # This has to be at the bottom, because of python reasons.
 if __name__ == "__main__":
-   start_game(init, update)
+    # Play the game as the module game, the one snapshots and replays look
+    # at, and not as __main__, which is a second copy of this file.
+    import game
+    game.main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+Levels too big to keep in memory, stored in chunks on disk.
+
+A level file has a header, the starts, and then every chunk of tiles, one
+bit per tile, chunk after chunk in rows. Every chunk takes the same number
+of bytes, so finding one is just math, and the file is mapped into memory
+instead of read, so only the chunks that are used are ever loaded from
+disk.
+
+ChunkedLevel plays such a file. Only the chunks around the players are
+loaded, as one WallGrid for the physics, and only the chunks the camera
+sees are drawn, from surfaces kept in a SurfaceCache. The rest of the level
+costs nothing, so levels can be thousands of tiles across.
+
+    python3 levels.py big.level --size 2000 2000
+    python3 game.py --level big.level
+"""
+import struct
+import argparse
+
+import numpy as np
+import pygame as pg
+
+import ribs
+import game
+
+MAGIC = b"MJLV"
+VERSION = 1
+# magic, version, tiles along a chunk, pixels along a tile, rows and columns of tiles, starts
+HEADER = struct.Struct("<4sHHHIII")
+# tile x, tile y
+START = struct.Struct("<II")
+
+
+def write_level(path, solid, starts, chunk=16, grid_size=game.GRID_SIZE):
+    """
+        Writes a level to a file, from a numpy array of which tiles are
+        walls and a list of starts as (tile_x, tile_y).
+    """
+    rows, cols = solid.shape
+    chunk_rows, chunk_cols = -(-rows // chunk), -(-cols // chunk)
+    padded = np.zeros((chunk_rows * chunk, chunk_cols * chunk), dtype=bool)
+    padded[:rows, :cols] = solid
+    # The tiles of every chunk next to eachother, chunk after chunk.
+    chunks = padded.reshape(chunk_rows, chunk, chunk_cols, chunk).swapaxes(1, 2)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, chunk, grid_size, rows, cols, len(starts)))
+        for tile_x, tile_y in starts:
+            f.write(START.pack(tile_x, tile_y))
+        f.write(np.packbits(chunks.reshape(chunk_rows, chunk_cols, -1), axis=2).tobytes())
+
+
+def make_arena(cols, rows, starts=8, seed=0):
+    """
+        A big level to try things with: walls around it, blocks of wall
+        all over it, and starts close to the middle, so the players don't
+        have to look for eachother for too long. Returns the same as
+        game.level_tiles.
+    """
+    rng = np.random.default_rng(seed)
+    solid = np.zeros((rows, cols), dtype=bool)
+    solid[[0, -1], :] = True
+    solid[:, [0, -1]] = True
+    count = rows * cols // 60
+    xs, ys = rng.integers(2, cols - 2, count), rng.integers(2, rows - 2, count)
+    widths, heights = rng.integers(1, 5, count), rng.integers(1, 5, count)
+    for x, y, width, height in zip(xs.tolist(), ys.tolist(), widths.tolist(), heights.tolist()):
+        solid[y:y + height, x:x + width] = True
+
+    found = []
+    middle_x, middle_y = cols // 2, rows // 2
+    spread = 4
+    while len(found) < starts:
+        x = middle_x + int(rng.integers(-spread, spread + 1))
+        y = middle_y + int(rng.integers(-spread, spread + 1))
+        spread += 1
+        # Room to move around the start.
+        if 0 < x < cols - 1 and 0 < y < rows - 1 and not solid[y - 1:y + 2, x - 1:x + 2].any():
+            if (x, y) not in found:
+                found.append((x, y))
+    return solid, found
+
+
+class ChunkedLevel:
+    """
+        A level file made by write_level, loaded a few chunks at a time.
+
+        activate(positions) gives a WallGrid of the chunks around the
+        players and margin chunks more in every direction. Everything
+        outside it counts as a wall, so shots that fly that far away are
+        culled. The grid is only made again when the players move into
+        other chunks.
+
+        The window is never more than max_chunks chunks along a side, so
+        the memory it takes doesn't grow with how far apart the players
+        are. That is also how far apart they can get, keep_inside holds
+        the players that try to go further at the edge of the window.
+
+        The physics gets a rect per wall tile, like level strings, unless
+        merge is True, see game.WallGrid for how that plays differently.
+
+        draw(surface, view) draws the part of the level the camera sees.
+        Chunks are drawn on a surface of their own once, and then kept in a
+        SurfaceCache of budget pixels.
+    """
+
+    def __init__(self, path, margin=1, merge=False, budget=4_000_000, max_chunks=16):
+        self.path = path
+        with open(path, "rb") as f:
+            data = f.read(HEADER.size)
+            magic, version, self.chunk, self.grid_size, self.rows, self.cols, count = \
+                HEADER.unpack(data)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a level this game can play")
+            starts = [START.unpack(f.read(START.size)) for _ in range(count)]
+        self.starts = [(x * self.grid_size, y * self.grid_size) for x, y in starts]
+        self.chunk_rows = -(-self.rows // self.chunk)
+        self.chunk_cols = -(-self.cols // self.chunk)
+        # Mapped, not read, the operating system reads the chunks we look at.
+        self.chunks = np.memmap(path, dtype=np.uint8, mode="r",
+                                offset=HEADER.size + count * START.size,
+                                shape=(self.chunk_rows, self.chunk_cols,
+                                       -(-self.chunk * self.chunk // 8)))
+        self.margin = margin
+        self.merge = merge
+        # At least the chunk of a player and the margin around it.
+        self.max_chunks = max(max_chunks, 2 * margin + 1)
+        # Where keep_inside keeps the players, in pixels, when they are
+        # too far apart for the window.
+        self.bounds = None
+        # The tiles of the chunks in the window, keyed on (chunk_x, chunk_y).
+        self.loaded = {}
+        self.window = None
+        self.walls = None
+        self.surfaces = ribs.SurfaceCache(budget)
+        self.drawn = None
+        self.loads = 0
+        self.builds = 0
+
+    def size(self):
+        """The size of the level in pixels."""
+        return (self.cols * self.grid_size, self.rows * self.grid_size)
+
+    def _read(self, chunk_x, chunk_y):
+        """Internal function, the tiles of a chunk, read from the file."""
+        bits = np.unpackbits(self.chunks[chunk_y, chunk_x], count=self.chunk * self.chunk)
+        return bits.reshape(self.chunk, self.chunk).astype(bool)
+
+    def tiles(self, chunk_x, chunk_y):
+        """The tiles of a chunk in the window, read once."""
+        key = (chunk_x, chunk_y)
+        tiles = self.loaded.get(key)
+        if tiles is None:
+            tiles = self.loaded[key] = self._read(chunk_x, chunk_y)
+            self.loads += 1
+        return tiles
+
+    def activate(self, positions):
+        """
+            The WallGrid of the chunks around positions, a numpy array of
+            world positions, like all the players. It only depends on the
+            positions, so a rewound game gets the same walls again.
+        """
+        if len(positions):
+            chunk_size = self.chunk * self.grid_size
+            chunks = np.array((self.chunk_cols, self.chunk_rows))
+            first = np.clip(np.floor_divide(positions.min(axis=0), chunk_size).astype(int),
+                            0, chunks - 1)
+            end = np.clip(np.floor_divide(positions.max(axis=0), chunk_size).astype(int) + 1,
+                          first + 1, chunks)
+            # Players too far apart get the chunks in the middle of them.
+            span = self.max_chunks - 2 * self.margin
+            too_far = end - first > span
+            middle_first = np.clip((first + end - span) // 2, 0, np.maximum(chunks - span, 0))
+            first = np.where(too_far, middle_first, first)
+            end = np.where(too_far, first + span, end)
+            self.bounds = None
+            if too_far.any():
+                self.bounds = (np.where(too_far, first * chunk_size, -np.inf),
+                               np.where(too_far, end * chunk_size, np.inf))
+            first = np.maximum(first - self.margin, 0)
+            end = np.minimum(end + self.margin, chunks)
+            window = tuple(first.tolist() + end.tolist())
+        else:
+            window = self.window or (0, 0, 1, 1)
+        if window != self.window:
+            self._build(window)
+        return self.walls
+
+    def keep_inside(self, pool):
+        """
+            Holds the bodies in pool, like the players, inside the chunks
+            activate picked when they are too far apart for max_chunks,
+            like the edge of the level would.
+        """
+        n = len(pool)
+        if self.bounds is None or not n:
+            return
+        low, high = self.bounds
+        half = (pool.size[:n] / 2)[:, None]
+        position = pool.position[:n]
+        held = np.clip(position, low + half, high - half)
+        stopped = held != position
+        pool.position[:n] = held
+        pool.velocity[:n][stopped] = 0
+
+    def _build(self, window):
+        """Internal function, makes the WallGrid of the chunks in window."""
+        first_x, first_y, end_x, end_y = window
+        for chunk_x, chunk_y in list(self.loaded):
+            if not (first_x <= chunk_x < end_x and first_y <= chunk_y < end_y):
+                del self.loaded[chunk_x, chunk_y]
+        solid = np.block([[self.tiles(chunk_x, chunk_y) for chunk_x in range(first_x, end_x)]
+                          for chunk_y in range(first_y, end_y)])
+        # The last chunks can go past the level.
+        solid = solid[:self.rows - first_y * self.chunk, :self.cols - first_x * self.chunk]
+        origin = (first_x * self.chunk * self.grid_size, first_y * self.chunk * self.grid_size)
+        self.walls = game.WallGrid(solid, self.grid_size, self.merge, origin)
+        self.window = window
+        self.builds += 1
+
+    def _render(self, chunk_x, chunk_y):
+        """Internal function, draws the walls of a chunk on a surface of its own."""
+        tiles = self.loaded.get((chunk_x, chunk_y))
+        if tiles is None:
+            tiles = self._read(chunk_x, chunk_y)
+        size = self.chunk * self.grid_size
+        image = pg.Surface((size, size)).convert()
+        for wall in game.WallGrid(tiles, self.grid_size, merge=True):
+            pg.draw.rect(image, game.WALL_COLOR, wall)
+        return image
+
+    def draw(self, surface, view):
+        """
+            Draws the part of the level in view, a pg.Rect in the world, on
+            surface, unless it's already there. Returns True if it drew.
+        """
+        if self.drawn == (surface, tuple(view)):
+            return False
+        surface.fill(pg.Color(0, 0, 0))
+        size = self.chunk * self.grid_size
+        first_x, first_y = max(view.left // size, 0), max(view.top // size, 0)
+        end_x = min(-(-view.right // size), self.chunk_cols)
+        end_y = min(-(-view.bottom // size), self.chunk_rows)
+        blits = []
+        for chunk_y in range(first_y, end_y):
+            for chunk_x in range(first_x, end_x):
+                key = (chunk_x, chunk_y)
+                image = self.surfaces.get(key)
+                if image is None:
+                    image = self._render(chunk_x, chunk_y)
+                    self.surfaces.put(key, image)
+                blits.append((image, (chunk_x * size - view.x, chunk_y * size - view.y)))
+        surface.blits(blits, doreturn=False)
+        self.drawn = (surface, tuple(view))
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="where to write the level")
+    parser.add_argument("--size", type=int, nargs=2, default=(1000, 1000),
+                        metavar=("COLUMNS", "ROWS"), help="size of the level in tiles")
+    parser.add_argument("--starts", type=int, default=8)
+    parser.add_argument("--chunk", type=int, default=16, help="tiles along a chunk")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    solid, starts = make_arena(*args.size, starts=args.starts, seed=args.seed)
+    write_level(args.path, solid, starts, chunk=args.chunk)
+    print(f"Wrote a {args.size[0]}x{args.size[1]} level with {solid.sum()} wall tiles "
+          f"to {args.path}")
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+Plays lots of bot against bot matches without a window, on every core, to
+see what changing the tuning of the players does.
+
+Run with `python3 matches.py 1000 --set shot_speed=200 --out results.csv`.
+Every match has its own seed, so running it again gives the same results,
+and with --sweep every value plays the same seeds.
+"""
+import os
+import sys
+import csv
+import math
+import argparse
+from time import perf_counter
+from multiprocessing import Pool
+
+# Draw to memory and play sound to nowhere, must be set before pygame starts.
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+import numpy as np
+import ribs
+import game
+
+# The level of the game, used when it has a start for every player.
+LEVEL = game.LEVEL
+
+# The tuning of the players that can be changed, and what it is by default.
+TUNING = {name: getattr(game.Player, name) for name in (
+    "min_size", "max_size", "gesmol_speeed", "walk_acc", "max_speed", "slow_down",
+    "shot_speed", "shot_delay_start", "shot_lifetime", "max_shots")}
+
+def arena_level(players, spacing=4):
+    """
+        An empty square level with a start for every player, spacing
+        tiles apart, for when the normal level has too few starts.
+    """
+    across = math.ceil(math.sqrt(players))
+    size = across * spacing + 1
+    rows = [["#" if x in (0, size - 1) or y in (0, size - 1) else " "
+             for x in range(size)] for y in range(size)]
+    for i in range(players):
+        rows[spacing // 2 + (i // across) * spacing][spacing // 2 + (i % across) * spacing] = "S"
+    return "\n".join("".join(row) for row in rows)
+
+
+FIELDS = ("match", "seed", "params", "winner", "seconds", "shots", "kills")
+
+
+def play_match(job):
+    """
+        Plays one match and returns its row of results. The match is over
+        when someone has enough kills, or after max_seconds of game time.
+        The winner is the player with the most kills, or 0 for a draw.
+    """
+    match, seed, params, players, kills, max_seconds = job
+    for name, value in params:
+        setattr(game.Player, name, value)
+    try:
+        ribs.HEADLESS = True
+        ribs.TIME = 0
+        game.PLAYER_COUNT = players
+        game.LEVEL = LEVEL if players <= LEVEL.count("S") else arena_level(players)
+        # Nobody plays with the keyboard, the bots move everyone.
+        game.KEYS = ()
+        game.shots.fired = 0
+        rng = np.random.default_rng(seed)
+        updater = game.update()
+
+        steps = 0
+        max_steps = round(max_seconds / ribs.delta())
+        while True:
+            game.bot_input(game.players, rng)
+            ribs.TIME += ribs.delta()
+            next(updater)
+            steps += 1
+            if steps >= max_steps or max(game.scores.values(), default=0) >= kills:
+                break
+    finally:
+        for name, _ in params:
+            setattr(game.Player, name, TUNING[name])
+
+    best = max(game.scores.values(), default=0)
+    leaders = [idx for idx, score in game.scores.items() if score == best]
+    winner = leaders[0] if best and len(leaders) == 1 else 0
+    return (match, seed, " ".join(f"{name}={value}" for name, value in params), winner,
+            round(steps * ribs.delta(), 3), game.shots.fired, sum(game.scores.values()))
+
+
+def parse_value(name, text):
+    """Turns text into a value for the tuning called name."""
+    if name not in TUNING:
+        raise argparse.ArgumentTypeError(
+            f"unknown tuning {name!r}, pick one of {', '.join(TUNING)}")
+    if text.lower() == "none":
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_setting(text):
+    """Takes NAME=VALUE and returns (name, value)."""
+    name, _, value = text.partition("=")
+    return name, parse_value(name, value)
+
+
+def parse_sweep(text):
+    """Takes NAME=V1,V2,... and returns a list of (name, value)."""
+    name, _, values = text.partition("=")
+    return [(name, parse_value(name, value)) for value in values.split(",")]
+
+
+def make_jobs(args):
+    """Every match to play, as the arguments to play_match."""
+    jobs = []
+    for sweep in args.sweep or [None]:
+        params = tuple(args.set or ()) + ((sweep, ) if sweep else ())
+        for i in range(args.matches):
+            jobs.append((len(jobs), args.seed + i, params, args.players, args.kills,
+                         args.seconds))
+    return jobs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("matches", nargs="?", type=int, default=100,
+                        help="matches to play (for every value of --sweep)")
+    parser.add_argument("--players", type=int, default=2)
+    parser.add_argument("--kills", type=int, default=5,
+                        help="kills needed to win a match")
+    parser.add_argument("--seconds", type=float, default=120,
+                        help="game time before a match is called")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first match")
+    parser.add_argument("--set", type=parse_setting, action="append", metavar="NAME=VALUE",
+                        help="change the tuning of the players, can be given more than once")
+    parser.add_argument("--sweep", type=parse_sweep, metavar="NAME=V1,V2,...",
+                        help="play all the matches once for every value")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes to play in, 1 plays in this one")
+    parser.add_argument("--out", help="write the results to this .csv file, "
+                                      "instead of printing them")
+    args = parser.parse_args()
+
+    jobs = make_jobs(args)
+    out = open(args.out, "w", newline="") if args.out else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(FIELDS)
+
+    start = perf_counter()
+    if args.workers == 1:
+        results = map(play_match, jobs)
+    else:
+        pool = Pool(args.workers)
+        # Big enough chunks to not wait on the pipe, small enough to keep
+        # every worker busy until the end.
+        results = pool.imap_unordered(play_match, jobs,
+                                      chunksize=max(1, len(jobs) // (args.workers * 8)))
+    for row in results:
+        writer.writerow(row)
+        out.flush()
+    elapsed = perf_counter() - start
+    if args.workers != 1:
+        pool.close()
+        pool.join()
+    if args.out:
+        out.close()
+    print(f"Played {len(jobs)} matches in {elapsed:.2f} s, "
+          f"{len(jobs) / elapsed:.1f} matches per second", file=sys.stderr)
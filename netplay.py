@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+"""
+Two players on two computers, with input delay and rollback.
+
+Every step both games send the buttons their player holds, for a step a
+few steps ahead (the input delay), so most of the time the other player's
+buttons arrive before they are needed. When they don't, the game guesses
+that the other player still holds what they held last and keeps going. If
+the guess was wrong, the game goes back to a snapshot of the step the
+buttons were for and plays the steps since again with the right buttons,
+which is the rollback.
+
+Every packet has all the buttons the other side hasn't said it has, so a
+lost packet is fixed by the next one. How the packets get there is up to
+the transport: UdpTransport sends them over UDP, and SimulatedNetwork
+wraps another transport to add latency, jitter and packet loss.
+
+    python3 netplay.py --test --latency 0.05 --jitter 0.01 --loss 0.1
+
+plays a match between two processes on this computer, over a bad network,
+and checks that both end up with exactly the same game.
+"""
+import os
+import sys
+import heapq
+import random
+import socket
+import struct
+import hashlib
+import argparse
+from time import perf_counter, sleep
+
+import numpy as np
+import pygame as pg
+
+import ribs
+import game
+import snapshots
+
+# first step, the last step fully known from the other side, number of steps
+PACKET = struct.Struct("<iiB")
+
+# The order of the actions in game.KEYS.
+ACTIONS = ("up", "down", "left", "right", "small", "shoot")
+
+
+class UdpTransport:
+    """Sends and receives packets over UDP, without ever waiting."""
+
+    def __init__(self, port, peer):
+        self.peer = peer
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("", port))
+        self.socket.setblocking(False)
+
+    def send(self, data):
+        self.socket.sendto(data, self.peer)
+
+    def receive(self):
+        """All packets that have arrived since last time."""
+        packets = []
+        while True:
+            try:
+                data, _ = self.socket.recvfrom(2048)
+            except (BlockingIOError, ConnectionResetError):
+                return packets
+            packets.append(data)
+
+    def close(self):
+        self.socket.close()
+
+
+class SimulatedNetwork:
+    """
+        Wraps a transport and makes it worse: every packet is held back
+        latency seconds, plus or minus jitter, and loss of them are lost.
+        Packets held back for different times can arrive out of order.
+    """
+
+    def __init__(self, transport, latency=0.05, jitter=0.01, loss=0.05, seed=None):
+        self.transport = transport
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.held_back = []
+        self.sent = 0
+        self.lost = 0
+
+    def send(self, data):
+        self.sent += 1
+        if self.rng.random() < self.loss:
+            self.lost += 1
+            return
+        when = perf_counter() + self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        heapq.heappush(self.held_back, (when, self.sent, data))
+
+    def receive(self):
+        now = perf_counter()
+        while self.held_back and self.held_back[0][0] <= now:
+            self.transport.send(heapq.heappop(self.held_back)[2])
+        return self.transport.receive()
+
+    def close(self):
+        self.transport.close()
+
+
+KEYBOARD = ribs.Bindings(**dict(zip(ACTIONS, game.KEYS[0])))
+
+
+def keyboard_input(step):
+    """
+        The actions held on this computer's keyboard, with the keys of the
+        first player. The keyboard is read straight from pygame, the held
+        buttons in ribs are the ones Rollback feeds the game.
+    """
+    pressed = pg.key.get_pressed()
+    return KEYBOARD.held_in({code for _, codes in KEYBOARD.codes for code in codes
+                             if pressed[code]})
+
+
+class Rollback:
+    """
+        An input hook for ribs that plays player slot (0 or 1) on this
+        computer and the other player over transport.
+
+        local_input(step) gives the actions held here, as the bits of
+        ribs Bindings, by default from the keyboard. delay is the input
+        delay in steps, at least 1. The game never guesses more than
+        max_prediction steps ahead of the other player, it waits for them
+        instead, and gives up after timeout seconds.
+    """
+
+    def __init__(self, transport, slot, local_input=keyboard_input, delay=2,
+                 max_prediction=8, timeout=5.0):
+        if delay < 1:
+            raise ValueError("The input delay has to be at least one step")
+        self.transport = transport
+        self.slot = slot
+        self.local_input = local_input
+        self.delay = delay
+        self.max_prediction = max_prediction
+        self.timeout = timeout
+        self.bindings = [ribs.Bindings(**dict(zip(ACTIONS, keys))) for keys in game.KEYS[:2]]
+
+        self.step = 0
+        # The actions of both players every step, and which of the other
+        # player's are known for sure. The first delay steps nobody can
+        # have pressed anything.
+        self.inputs = np.zeros((1024, 2), dtype=np.uint8)
+        self.known = np.zeros(1024, dtype=bool)
+        self.known[:delay] = True
+        # The last step the other player is known for, with every step before it.
+        self.confirmed = delay - 1
+        # The last step the other player has all of ours for.
+        self.acked = delay - 1
+        # The other player's newest known actions, the guess for the steps after.
+        self.guess = 0
+        self.rollback_to = None
+        self.resimulating = False
+        # The time of the step before, which is the time a snapshot needs.
+        self.last_time = ribs.TIME
+        self.ring = snapshots.SnapshotRing(max_prediction + delay + 4)
+
+        self.rollbacks = 0
+        self.resimulated = 0
+        # Seconds spent playing steps again, for every step played.
+        self.resimulation_times = []
+
+    def _grow(self, step):
+        """Internal function, makes room for the inputs of step."""
+        while step >= len(self.known):
+            self.inputs = np.concatenate((self.inputs, np.zeros_like(self.inputs)))
+            self.known = np.concatenate((self.known, np.zeros_like(self.known)))
+
+    def __call__(self):
+        if self.resimulating:
+            self._play(self.step)
+            return
+        step = self.step
+        self._grow(step + self.delay)
+        self.inputs[step + self.delay, self.slot] = self.local_input(step)
+        self._send()
+        self._receive()
+
+        # Too far ahead of the other player, wait for them.
+        waited = perf_counter()
+        while step - self.confirmed > self.max_prediction:
+            if perf_counter() - waited > self.timeout:
+                raise ConnectionError("The other player stopped answering")
+            sleep(0.001)
+            self._send()
+            self._receive()
+
+        took = 0.0
+        if self.rollback_to is not None:
+            start = perf_counter()
+            with ribs.timed("rollback"):
+                self._rollback(step)
+            took = perf_counter() - start
+        self.resimulation_times.append(took)
+        self._play(step)
+
+    def _play(self, step):
+        """Internal function, saves the game and holds the actions of step."""
+        self.ring.save(step, self.last_time)
+        remote = 1 - self.slot
+        if not self.known[step]:
+            self.inputs[step, remote] = self.guess
+        held = ribs.current_frame_held_buttons
+        held.clear()
+        for bindings, bits in zip(self.bindings, self.inputs[step].tolist()):
+            bindings.hold(bits, held)
+        self.step = step + 1
+        self.last_time = ribs.TIME
+
+    def _rollback(self, step):
+        """Internal function, plays the steps since a wrong guess again."""
+        start, self.rollback_to = self.rollback_to, None
+        self.ring.restore(start)
+        self.last_time = ribs.TIME
+        self.step = start
+        self.resimulating = True
+        try:
+            ribs.run_steps(step - start)
+        finally:
+            self.resimulating = False
+        # The main loop has already moved the time on for the step it's
+        # about to run.
+        ribs.TIME += ribs.delta()
+        self.rollbacks += 1
+        self.resimulated += step - start
+
+    def _send(self):
+        """Internal function, sends every step of ours the other side doesn't have."""
+        first = self.acked + 1
+        # As many as fit in the count, the rest go in the next packet.
+        last = min(self.step + self.delay, first + 254)
+        inputs = self.inputs[first:last + 1, self.slot].tobytes()
+        self.transport.send(PACKET.pack(first, self.confirmed, len(inputs)) + inputs)
+
+    def _receive(self):
+        """Internal function, takes in the other side's steps, and finds wrong guesses."""
+        remote = 1 - self.slot
+        for packet in self.transport.receive():
+            first, acked, count = PACKET.unpack_from(packet)
+            self.acked = max(self.acked, acked)
+            self._grow(first + count)
+            for step, bits in enumerate(packet[PACKET.size:PACKET.size + count], first):
+                if self.known[step]:
+                    continue
+                if step < self.step and self.inputs[step, remote] != bits:
+                    if self.rollback_to is None or step < self.rollback_to:
+                        self.rollback_to = step
+                self.inputs[step, remote] = bits
+                self.known[step] = True
+            while self.known[self.confirmed + 1]:
+                self.confirmed += 1
+                self._grow(self.confirmed + 2)
+            self.guess = self.inputs[self.confirmed, remote]
+
+    def linger(self, seconds=1.0):
+        """
+            Keeps sending and receiving for a while after the last step, so
+            the other side gets our last steps even if packets are lost.
+        """
+        end = perf_counter() + seconds
+        while perf_counter() < end:
+            self._send()
+            self._receive()
+            sleep(0.005)
+
+    def stats(self):
+        """How many rollbacks there were, and what they cost."""
+        times = np.array(self.resimulation_times) * 1000
+        return {
+            "steps": self.step,
+            "rollbacks": self.rollbacks,
+            "resimulated steps": self.resimulated,
+            "resimulation ms per step": float(times.mean()) if len(times) else 0.0,
+            "resimulation ms max": float(times.max()) if len(times) else 0.0,
+        }
+
+
+#
+# Testing on one computer
+#
+
+def scripted_input(slot):
+    """Deterministic actions for a test player, changing every few steps."""
+    def actions(step):
+        rng = random.Random(step // 10 * 2 + slot)
+        return rng.getrandbits(len(ACTIONS))
+    return actions
+
+
+def state_digest(snapshot):
+    """A hash of the game in a snapshot, that doesn't depend on the capacities."""
+    fields = snapshot.fields
+    digest = hashlib.sha1()
+    players = int(fields["player_count"])
+    shots = int(fields["shot_count"])
+    for name in game.PlayerPool.ARRAYS:
+        digest.update(fields["player_" + name][:players].tobytes())
+    for name in game.ShotPool.ARRAYS:
+        digest.update(fields["shot_" + name][:shots].tobytes())
+    for name in ("time", "new_round", "scores", "feed", "feed_count"):
+        digest.update(fields[name].tobytes())
+    return digest.hexdigest()
+
+
+def play_peer(slot, port, peer_port, steps, latency, jitter, loss, results):
+    """Plays one side of a test match and puts its results in the results queue."""
+    network = SimulatedNetwork(UdpTransport(port, ("127.0.0.1", peer_port)),
+                               latency, jitter, loss, seed=slot)
+    session = Rollback(network, slot, scripted_input(slot))
+    ribs.set_input_hook(session)
+    # Keep going until every step up to steps is known on this side.
+    checked = {}
+
+    def update():
+        updater = game.update()
+        while True:
+            yield next(updater)
+            if steps in session.ring and session.confirmed >= steps - 1 and not checked:
+                checked["digest"] = state_digest(session.ring.snapshots[steps % len(session.ring)])
+            if checked and session.step > steps + session.delay + session.max_prediction:
+                # Enough for the other side to have everything too.
+                return
+
+    ribs.start_game(game.init, update, headless=True)
+    session.linger()
+    network.close()
+    results.put((slot, checked.get("digest"), session.stats(), network.lost, network.sent))
+
+
+def test(steps, latency, jitter, loss, port=47800):
+    """Plays a test match between two processes, returns True if they agree."""
+    from multiprocessing import Process, Queue
+    results = Queue()
+    peers = [Process(target=play_peer, args=(slot, port + slot, port + 1 - slot, steps,
+                                             latency, jitter, loss, results))
+             for slot in (0, 1)]
+    for peer in peers:
+        peer.start()
+    outcome = sorted(results.get() for _ in peers)
+    for peer in peers:
+        peer.join()
+    for slot, digest, stats, lost, sent in outcome:
+        print(f"player {slot + 1}: lost {lost} of {sent} packets, " +
+              ", ".join(f"{name} {value:.3f}" if isinstance(value, float) else
+                        f"{name} {value}" for name, value in stats.items()))
+    same = outcome[0][1] is not None and outcome[0][1] == outcome[1][1]
+    print(f"Step {steps} is {'the same' if same else 'DIFFERENT'} on both sides.")
+    return same
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test", action="store_true",
+                        help="play a test match between two processes on this computer")
+    parser.add_argument("--steps", type=int, default=600, help="steps in the test match")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds, one way")
+    parser.add_argument("--jitter", type=float, default=0.01, help="seconds")
+    parser.add_argument("--loss", type=float, default=0.05, help="share of lost packets")
+    args = parser.parse_args()
+    if args.test:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+        sys.exit(0 if test(args.steps, args.latency, args.jitter, args.loss) else 1)
+    parser.print_help()
@@ -0,0 +1,225 @@
+"""
+Recording matches as the buttons every player held, and playing them back.
+
+A replay file starts with a header, and then has chunks of two kinds:
+- inputs, one byte per player and step with a bit for every action that
+  was held, for a second of steps at a time.
+- keyframes, a snapshot of the whole game every few seconds, so playback
+  can jump close to any step and only simulate the last bit.
+Chunks are compressed with zlib when that makes them smaller, and they are
+written as the match goes on, so a crash loses at most a second.
+
+The header also has how many players there were and which level they
+played on, a ChunkedLevel's path and a digest of the level, since a match
+only plays the same way again with the same players on the same level.
+
+Both Recorder and Replay are input hooks for ribs, see set_input_hook:
+
+    set_input_hook(Recorder("match.replay"))
+    set_input_hook(Replay("match.replay"))
+"""
+import zlib
+import struct
+import hashlib
+
+import numpy as np
+
+import ribs
+import game
+import snapshots
+
+MAGIC = b"MJRP"
+VERSION = 2
+# magic, version, players, players at the keyboard, steps between keyframes,
+# seconds per step, length of the keys, length of the level path, level digest
+HEADER = struct.Struct("<4sHHHIdHH20s")
+# kind, compressed, the first step, length of the data
+CHUNK = struct.Struct("<cBII")
+INPUTS = b"I"
+KEYFRAME = b"K"
+
+# The order of the actions in game.KEYS.
+ACTIONS = ("up", "down", "left", "right", "small", "shoot")
+
+
+def level_digest(level):
+    """
+        A digest of a level, a level string or a ChunkedLevel, that only
+        is the same for the same level.
+    """
+    digest = hashlib.sha1()
+    if isinstance(level, str):
+        digest.update(level.encode())
+    else:
+        with open(level.path, "rb") as f:
+            while block := f.read(1 << 20):
+                digest.update(block)
+    return digest.digest()
+
+
+def _bindings(keys):
+    """Internal function, the Bindings of one player's keys in game.KEYS."""
+    return ribs.Bindings(**dict(zip(ACTIONS, keys)))
+
+
+class Recorder:
+    """
+        Records the buttons held by the players at the keyboard every step,
+        and a keyframe every keyframe_every steps, to the file at path.
+        Call close when the match is over.
+    """
+
+    def __init__(self, path, keyframe_every=300, chunk_steps=60):
+        self.file = open(path, "wb")
+        self.keyframe_every = keyframe_every
+        self.chunk_steps = chunk_steps
+        keys = game.KEYS[:game.PLAYER_COUNT]
+        self.bindings = [_bindings(player_keys) for player_keys in keys]
+        joined = " ".join(keys).encode()
+        level_path = b"" if isinstance(game.LEVEL, str) else game.LEVEL.path.encode()
+        self.file.write(HEADER.pack(MAGIC, VERSION, game.PLAYER_COUNT, len(keys),
+                                    keyframe_every, ribs.delta(), len(joined),
+                                    len(level_path), level_digest(game.LEVEL)))
+        self.file.write(joined)
+        self.file.write(level_path)
+
+        self.step = 0
+        self.chunk_start = 0
+        self.inputs = bytearray()
+        self.snapshot = None
+        # The time of the step before, which is the time in a keyframe.
+        self.last_time = ribs.TIME
+
+    def __call__(self):
+        if self.step and self.step % self.keyframe_every == 0:
+            self._flush()
+            # The game is as the step before left it, but the time has
+            # already moved on to this step.
+            self.snapshot = snapshots.save(self.snapshot, self.step, self.last_time)
+            self._write(KEYFRAME, self.step, bytes(self.snapshot))
+        held = ribs.current_frame_held_buttons
+        for bindings in self.bindings:
+            self.inputs.append(bindings.held_in(held))
+        self.step += 1
+        self.last_time = ribs.TIME
+        if self.step - self.chunk_start >= self.chunk_steps:
+            self._flush()
+
+    def _flush(self):
+        """Internal function, writes the inputs not written yet."""
+        if self.inputs:
+            self._write(INPUTS, self.chunk_start, bytes(self.inputs))
+            self.inputs.clear()
+        self.chunk_start = self.step
+
+    def _write(self, kind, step, data):
+        """Internal function, writes a chunk, compressed if that's smaller."""
+        packed = zlib.compress(data, 1)
+        compressed = len(packed) < len(data)
+        if compressed:
+            data = packed
+        self.file.write(CHUNK.pack(kind, compressed, step, len(data)))
+        self.file.write(data)
+
+    def close(self):
+        """Writes what's left and closes the file."""
+        self._flush()
+        self.file.close()
+
+
+class Replay:
+    """
+        Plays back a file made by a Recorder, by holding the recorded
+        buttons before every step. The game stops when the recording ends.
+        The game has to have players players on the level the recording
+        was made on, see level_path and level_digest.
+
+        seek(step) jumps to a step, from the closest keyframe before it,
+        running the steps after the keyframe as fast as possible.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        (magic, version, self.players, keyboard, self.keyframe_every, self.delta,
+         keys_length, path_length, self.level_digest) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a replay this game can play")
+        offset = HEADER.size
+        keys = data[offset:offset + keys_length].decode().split()
+        offset += keys_length
+        # The path of the ChunkedLevel it was played on, or "" for a level string.
+        self.level_path = data[offset:offset + path_length].decode()
+        offset += path_length
+        self.bindings = [_bindings(player_keys) for player_keys in keys]
+
+        inputs = []
+        # Where the data of every keyframe is, read when it's needed.
+        self.keyframes = {}
+        while offset < len(data):
+            kind, compressed, step, length = CHUNK.unpack_from(data, offset)
+            offset += CHUNK.size
+            chunk = data[offset:offset + length]
+            offset += length
+            if kind == INPUTS:
+                inputs.append(zlib.decompress(chunk) if compressed else chunk)
+            elif kind == KEYFRAME:
+                self.keyframes[step] = (chunk, compressed)
+        self.inputs = np.frombuffer(b"".join(inputs), dtype=np.uint8).reshape(-1, keyboard)
+
+        self.step = 0
+        # The time of the step before, like in a keyframe.
+        self.last_time = 0.0
+        self.target = None
+        self.seeking = False
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def seek(self, step):
+        """Jumps to step before the next step is played."""
+        self.target = min(max(step, 0), len(self) - 1)
+
+    def __call__(self):
+        if self.target is not None and not self.seeking:
+            self._seek()
+        if self.step >= len(self):
+            return False
+        held = ribs.current_frame_held_buttons
+        held.clear()
+        for bindings, bits in zip(self.bindings, self.inputs[self.step].tolist()):
+            bindings.hold(bits, held)
+        self.step += 1
+        self.last_time = ribs.TIME
+
+    def _seek(self):
+        """Internal function, gets the game to just before the target step."""
+        target, self.target = self.target, None
+        keyframe = max((step for step in self.keyframes if step <= target), default=None)
+        self.seeking = True
+        try:
+            if self.step <= target and (keyframe is None or keyframe <= self.step):
+                # Closer to keep going than to go back to a keyframe.
+                ribs.TIME = self.last_time
+            elif keyframe is not None:
+                if self.step == 0:
+                    # The first step sets up the game, it has to run before
+                    # a keyframe can be put into it.
+                    ribs.TIME = self.last_time
+                    ribs.run_steps(1)
+                chunk, compressed = self.keyframes[keyframe]
+                snapshots.restore(snapshots.Snapshot.from_bytes(
+                    zlib.decompress(chunk) if compressed else chunk))
+                self.step = keyframe
+            else:
+                # Before the first keyframe, start over.
+                ribs.restart()
+                ribs.current_frame_held_buttons.clear()
+                ribs.last_frame_held_buttons.clear()
+                self.step = 0
+            ribs.run_steps(target - self.step)
+            # The main loop has already moved the time on for the step it's
+            # about to run.
+            ribs.TIME += ribs.delta()
+        finally:
+            self.seeking = False
@@ -15,6 +15,10 @@
 # if you'd rather read that! :D
 #
 
+# The time the game started importing, to see how long starting takes.
+from time import perf_counter
+_IMPORT_START = perf_counter()
+
 import pygame as pg
 # For smaller cheat sheet see:
 #   https://www.lithekod.se/pygame.html
@@ -23,34 +27,55 @@ import pygame as pg
 
 # math has sin, cos and other interesting things.
 import math
+import os
+import csv
+import json
+import queue
+import shutil
+import threading
+import subprocess
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+# numpy does math on whole arrays of numbers at once.
+import numpy as np
 
 #
 # Input handling
 #
 
-def _event_is(event: pg.event, kind: str) -> bool:
-    """Internal function to check the kind of pygame event"""
-    return pg.event.event_name(event.type) == kind
-
-
 current_frame_held_buttons = set()
-last_frame_held_buttons = None
-def process_events():
-    """Tells the game what buttons are pressed."""
+last_frame_held_buttons = set()
+def process_events(new_frame=True):
+    """
+        Tells the game what buttons are pressed. With new_frame the buttons
+        held until now count as last frame's, for key_pressed and
+        key_released.
+    """
     running = True
-    global last_frame_held_buttons
-    last_frame_held_buttons = current_frame_held_buttons.copy()
+    if new_frame:
+        _next_input_frame()
+    # The event types are plain numbers, comparing them is a lot cheaper
+    # than looking up the name of every event.
     for event in pg.event.get():
-        if _event_is(event, "Quit"):
-            running = False
-        elif _event_is(event, "KeyDown"):
+        kind = event.type
+        if kind == pg.KEYDOWN:
             current_frame_held_buttons.add(event.key)
-        elif _event_is(event, "KeyUp"):
-            if event.key in current_frame_held_buttons:
-                current_frame_held_buttons.remove(event.key)
+        elif kind == pg.KEYUP:
+            current_frame_held_buttons.discard(event.key)
+        elif kind == pg.QUIT:
+            running = False
     return running
 
 
+def _next_input_frame():
+    """
+        Internal function, the buttons held now become last frame's buttons.
+        Both sets are kept and refilled, so no new set is made every frame.
+    """
+    last_frame_held_buttons.clear()
+    last_frame_held_buttons.update(current_frame_held_buttons)
+
+
 def _to_keycode(key):
     """
         Takes a keycode or a character and converts it to a keycode
@@ -60,7 +85,7 @@ def _to_keycode(key):
     """
     if type(key) == str:
         if len(key) != 1:
-            raise "error"
+            raise ValueError(f"A key is a single character, not {key!r}")
         return ord(key.lower())
     return key
 
@@ -94,26 +119,254 @@ def key_pressed(key):
            (keycode not in last_frame_held_buttons)
 
 
+class Bindings:
+    """
+        Gives names to keys, like "shoot" or "left", so the game can ask
+        about actions instead of keys. The keys are turned into keycodes
+        once, when the bindings are made, and update works out the state of
+        every action once a frame. After that, asking about an action is
+        just checking a bit.
+
+        An action can be bound to a single key or to several keys, then it's
+        held if any of them are.
+    """
+
+    def __init__(self, **actions):
+        self.bits = {}
+        self.codes = []
+        for i, (action, keys) in enumerate(actions.items()):
+            if isinstance(keys, (str, int)):
+                keys = (keys, )
+            self.bits[action] = 1 << i
+            self.codes.append((1 << i, tuple(_to_keycode(key) for key in keys)))
+        # One bit per action, for this frame and the one before.
+        self.held = 0
+        self.last_held = 0
+
+    def held_in(self, buttons):
+        """The actions held in a set of buttons, as one bit per action."""
+        held = 0
+        for bit, codes in self.codes:
+            for code in codes:
+                if code in buttons:
+                    held |= bit
+                    break
+        return held
+
+    def update(self):
+        """
+            Reads the buttons held this frame and last frame. Call it once
+            a frame, after process_events, before asking about actions.
+        """
+        self.held = self.held_in(current_frame_held_buttons)
+        self.last_held = self.held_in(last_frame_held_buttons)
+
+    def hold(self, held, buttons):
+        """
+            The opposite of held_in, adds the first key of every action in
+            held (one bit per action) to a set of buttons.
+        """
+        for bit, codes in self.codes:
+            if held & bit:
+                buttons.add(codes[0])
+
+    def down(self, action):
+        """Says if the action is held down."""
+        return bool(self.held & self.bits[action])
+
+    def pressed(self, action):
+        """Says if the action was pressed down this frame."""
+        return bool(self.held & ~self.last_held & self.bits[action])
+
+    def released(self, action):
+        """Says if the action was released this frame."""
+        return bool(~self.held & self.last_held & self.bits[action])
+
+
 #
 # Simple sprite drawing
 #
 
+class SurfaceCache:
+    """
+        Remembers surfaces so they don't have to be made again, as long as
+        they fit in budget pixels. The least recently used surfaces are
+        thrown away first. Every surface can have an owner, which has to
+        be the same object when getting it back.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.pixels = 0
+
+    def get(self, key, owner=None):
+        """The surface saved as key, or None if there isn't one."""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] is not owner:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, surface, owner=None):
+        """Saves surface as key, unless it's bigger than the whole budget."""
+        self.remove(key)
+        pixels = surface.get_width() * surface.get_height()
+        if pixels > self.budget:
+            return
+        self.entries[key] = (owner, surface)
+        self.pixels += pixels
+        while self.pixels > self.budget:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        """Forgets the surface saved as key, if there is one."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.pixels -= entry[1].get_width() * entry[1].get_height()
+
+    def invalidate(self, owner=None):
+        """Forgets every surface owned by owner, or all of them if owner is None."""
+        for key, (entry_owner, _) in list(self.entries.items()):
+            if owner is None or entry_owner is owner:
+                self.remove(key)
+
+
+# Scaling and rotating is slow, so the results are kept and reused. Angles
+# are rounded to the nearest TRANSFORM_ANGLE_STEP degrees, so a slowly
+# spinning sprite can reuse them too.
+TRANSFORM_CACHE = SurfaceCache(4_000_000)
+TRANSFORM_ANGLE_STEP = 1
+
+
+def _transformed(img, size, degrees):
+    """Internal function, img scaled to size and rotated, from the cache if possible."""
+    # Another image can get the id of one that's gone, so the image owns it.
+    key = (id(img), size, degrees)
+    result = TRANSFORM_CACHE.get(key, img)
+    if result is not None:
+        return result
+
+    result = img
+    if size != img.get_size():
+        result = pg.transform.scale(result, size)
+    if degrees:
+        # Pygame rotates CCW in degrees, for some reason.
+        result = pg.transform.rotate(result, -degrees)
+    TRANSFORM_CACHE.put(key, result, img)
+    return result
+
+
+def invalidate_transform_cache(img=None):
+    """
+        Forgets the scaled and rotated versions of img, or of every image
+        if img is None. Call it if you draw on an image after drawing it.
+    """
+    TRANSFORM_CACHE.invalidate(img)
+
+
 def draw_transformed(img, position, scale=(1., 1.), degrees=0):
     """
         Draw img centered at position, scale the image and then rotate it in
         degrees before drawing.
     """
+    w, h = img.get_size()
     if scale[0] != 1. or scale[1] != 1.:
-        w, h = img.get_size()
         w = int(w * scale[0])
         h = int(h * scale[1])
-        img = pg.transform.scale(img, (w, h))
-    if degrees:
-        # Pygame rotates CCW in degrees, for some reason.
-        img = pg.transform.rotate(img, -degrees)
+    if TRANSFORM_ANGLE_STEP:
+        degrees = round(degrees / TRANSFORM_ANGLE_STEP) * TRANSFORM_ANGLE_STEP
+    degrees %= 360
+    if (w, h) != img.get_size() or degrees:
+        img = _transformed(img, (w, h), degrees)
     w, h = img.get_size()
     window = pg.display.get_surface()
-    window.blit(img, (int(position[0] - w / 2.0), int(position[1] - h / 2.0)))
+    mark_dirty(window.blit(img, (int(position[0] - w / 2.0), int(position[1] - h / 2.0))))
+
+
+# The squares draw_squares blits, one surface per color and size.
+SQUARE_CACHE = SurfaceCache(100_000)
+# With more squares than this, draw_squares writes the pixels with numpy
+# instead of blitting. Writing costs about the same for any number of
+# squares, on a 500x500 screen it wins from a few thousand, see bench.py.
+PIXEL_SQUARES = 5_000
+
+
+def _square(color, size):
+    """Internal function, a square of color, size pixels across."""
+    key = (tuple(color), size)
+    square = SQUARE_CACHE.get(key)
+    if square is None:
+        square = pg.Surface((size, size)).convert()
+        square.fill(color)
+        SQUARE_CACHE.put(key, square)
+    return square
+
+
+def draw_squares(centers, sizes, color):
+    """
+        Draws many filled squares of one color at once, centered on a
+        numpy array of (x, y) rows in pixels, with a numpy array of sizes.
+        Looks exactly like calling pg.draw.rect for every square, but the
+        squares are drawn once per size and then all blitted in one go,
+        or with very many of them written straight into the pixels.
+    """
+    # Rects with floats in them are cut off towards zero, like here.
+    widths = sizes.astype(int)
+    lefts = (centers[:, 0] - sizes / 2).astype(int)
+    tops = (centers[:, 1] - sizes / 2).astype(int)
+    shown = widths > 0
+    if not shown.all():
+        widths, lefts, tops = widths[shown], lefts[shown], tops[shown]
+    if not len(widths):
+        return
+    window = pg.display.get_surface()
+    if len(widths) > PIXEL_SQUARES and window.get_bytesize() != 3:
+        _write_squares(window, lefts, tops, widths, color)
+        return
+
+    positions = zip(lefts.tolist(), tops.tolist())
+    if widths.min() == widths.max():
+        square = _square(color, int(widths[0]))
+        blits = [(square, position) for position in positions]
+    else:
+        squares = {int(size): _square(color, int(size)) for size in np.unique(widths)}
+        blits = [(squares[size], position)
+                 for size, position in zip(widths.tolist(), positions)]
+    rects = window.blits(blits, doreturn=not HEADLESS)
+    if rects:
+        DIRTY_RECTS.extend(rects)
+
+
+def _write_squares(window, lefts, tops, widths, color):
+    """
+        Internal function, draws squares by writing the pixels they cover.
+        Every square adds one to its top left corner and the corner after
+        its bottom right, and takes one away at the other two corners.
+        Summing that along both axes counts the squares on every pixel, so
+        the work doesn't grow with the size of the squares.
+    """
+    width, height = window.get_size()
+    rights = np.clip(lefts + widths, 0, width)
+    bottoms = np.clip(tops + widths, 0, height)
+    lefts = np.clip(lefts, 0, width)
+    tops = np.clip(tops, 0, height)
+    corners = np.concatenate((lefts * (height + 1) + tops, rights * (height + 1) + bottoms,
+                              lefts * (height + 1) + bottoms, rights * (height + 1) + tops))
+    signs = np.repeat((1.0, 1.0, -1.0, -1.0), len(lefts))
+    counts = np.bincount(corners, signs, minlength=(width + 1) * (height + 1))
+    covered = counts.reshape(width + 1, height + 1).cumsum(axis=0).cumsum(axis=1)[:-1, :-1] > 0.5
+
+    pixels = pg.surfarray.pixels2d(window)
+    pixels[covered] = window.map_rgb(color)
+    # The surface is locked until the pixels are let go.
+    del pixels
+    mark_dirty(pg.Rect(lefts.min(), tops.min(),
+                       rights.max() - lefts.min(), bottoms.max() - tops.min()))
 
 
 def clear_screen(color):
@@ -121,35 +374,476 @@ def clear_screen(color):
     window = pg.display.get_surface()
     top_left = (0, 0)
     bottom_right = pg.display.get_surface().get_size()
-    pg.draw.rect(window, color, (top_left, bottom_right))
+    mark_dirty(pg.draw.rect(window, color, (top_left, bottom_right)))
+
+#
+# Background and dirty rects
+#
+# With a background set, the screen isn't cleared and flipped every frame.
+# Only the parts where something was drawn (the dirty rects) are sent to
+# the screen and then painted over with the background again.
+#
+
+BACKGROUND = None
+# If the dirty rects cover more than this part of the screen, just flip.
+DIRTY_LIMIT = 0.5
+DIRTY_RECTS = []
+LAST_DIRTY_RECTS = []
+FULL_REDRAW = True
+
+
+def set_background(surface):
+    """
+        Draws surface behind everything, instead of clearing the screen to
+        black every frame. Draw things that never move on it once, and
+        they don't cost anything after that. None goes back to clearing.
+        Returns the surface that is used, a copy of surface in the format
+        of the screen, to draw on later with redraw_background.
+    """
+    global BACKGROUND, FULL_REDRAW
+    if surface is not None:
+        # Blitting is a lot faster when the pixels are in the screen's format.
+        surface = surface.convert()
+    BACKGROUND = surface
+    FULL_REDRAW = True
+    return surface
+
+
+def redraw_background():
+    """
+        Tells ribs the background was drawn on, like when the camera
+        moved, so the whole screen is drawn again next frame.
+    """
+    global FULL_REDRAW
+    FULL_REDRAW = True
+
+
+def mark_dirty(rect):
+    """
+        Tells ribs that something was drawn in rect this frame. The ribs
+        drawing functions do this for you, but pg.draw functions don't.
+    """
+    if not HEADLESS:
+        DIRTY_RECTS.append(rect)
+
+
+def present():
+    """
+        Shows this frame on the screen and gets it ready for the next one.
+        start_game calls this for you.
+    """
+    global DIRTY_RECTS, LAST_DIRTY_RECTS, FULL_REDRAW
+    window = pg.display.get_surface()
+    if CAPTURE is not None:
+        with timed("loop: capture"):
+            CAPTURE.capture(window)
+    if BACKGROUND is None:
+        pg.display.flip()
+        clear_screen(pg.Color(0, 0, 0))
+        DIRTY_RECTS.clear()
+        return
+
+    # Where things were last frame has to be updated too, they are gone now.
+    rects = LAST_DIRTY_RECTS + DIRTY_RECTS
+    width, height = window.get_size()
+    if FULL_REDRAW or sum(r.w * r.h for r in rects) > DIRTY_LIMIT * width * height:
+        pg.display.flip()
+        window.blit(BACKGROUND, (0, 0))
+    else:
+        pg.display.update(rects)
+        window.blits([(BACKGROUND, rect, rect) for rect in DIRTY_RECTS], doreturn=False)
+    FULL_REDRAW = False
+    LAST_DIRTY_RECTS = DIRTY_RECTS
+    DIRTY_RECTS = []
+
+#
+# Capturing frames
+#
+# While capturing, present copies every frame right before it's shown, and
+# a thread writes it out, so recording a match doesn't need a screen
+# recorder fighting the game for the CPU. The pixels are copied straight
+# from the window into one of a few buffers that are used over and over.
+# If the writer falls behind and no buffer is free, the frame is dropped
+# and counted, the game never waits for the writer.
+#
+
+CAPTURE = None
+# Paths with these endings are sent to ffmpeg, if it is installed.
+VIDEO_ENDINGS = (".mp4", ".mkv", ".webm", ".mov", ".avi")
+
+
+class _FrameWriter:
+    """
+        Internal class, the buffers and the thread that writes what
+        start_capture captures. The buffers are made when the first frame
+        comes, when the size of the window is known.
+    """
+
+    def __init__(self, path, buffers):
+        self.path = path
+        self.buffers = buffers
+        self.free = queue.Queue()
+        self.ready = queue.Queue()
+        # width, height, pitch, bytes per pixel, shifts, masks and losses of red, green and blue.
+        self.layout = None
+        self.rgb = None
+        self.frames = 0
+        self.written = 0
+        self.dropped = 0
+        self.output = None
+        self.encoder = None
+        self.error = None
+        self.thread = threading.Thread(target=self._write_all, name="capture", daemon=True)
+        self.thread.start()
+
+    def capture(self, window):
+        """Copies the pixels of window into a free buffer, or drops the frame."""
+        width, height = window.get_size()
+        if self.layout is None:
+            self.layout = (width, height, window.get_pitch(), window.get_bytesize(),
+                           window.get_shifts()[:3], window.get_masks()[:3],
+                           window.get_losses()[:3])
+            self.fps = FRAMERATE or 60
+            for _ in range(self.buffers):
+                self.free.put(np.empty((height, window.get_pitch()), dtype=np.uint8))
+        self.frames += 1
+        if (width, height) != self.layout[:2]:
+            # A video can't change size, the window did.
+            self.dropped += 1
+            return
+        try:
+            buffer = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return
+        pixels = window.get_buffer()
+        np.copyto(buffer, np.frombuffer(pixels, dtype=np.uint8).reshape(buffer.shape))
+        # The window is locked for as long as the buffer of its pixels lives.
+        del pixels
+        self.ready.put(buffer)
+
+    def _to_rgb(self, buffer):
+        """Internal function, the pixels of a buffer as red, green, blue bytes."""
+        width, height, _, bytesize, shifts, masks, losses = self.layout
+        rows = buffer[:, :width * bytesize]
+        if bytesize == 4:
+            values = rows.view(np.uint32)
+        else:
+            channels = rows.reshape(height, width, bytesize).astype(np.uint32)
+            values = sum(channels[:, :, i] << (8 * i) for i in range(bytesize))
+        if self.rgb is None:
+            self.rgb = np.empty((height, width, 3), dtype=np.uint8)
+        for i in range(3):
+            self.rgb[:, :, i] = ((values & masks[i]) >> shifts[i]) << losses[i]
+        return self.rgb
+
+    def _open(self):
+        """Internal function, opens where the frames go, once the size is known."""
+        width, height = self.layout[:2]
+        if "%" in self.path:
+            return
+        if self.path.lower().endswith(VIDEO_ENDINGS):
+            if shutil.which("ffmpeg"):
+                self.encoder = subprocess.Popen(
+                    ["ffmpeg", "-loglevel", "error", "-y",
+                     "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}",
+                     "-r", str(self.fps), "-i", "-", "-pix_fmt", "yuv420p", self.path],
+                    stdin=subprocess.PIPE)
+                self.output = self.encoder.stdin
+                return
+            self.path = os.path.splitext(self.path)[0] + ".raw"
+            print(f"ffmpeg isn't installed, capturing raw frames to {self.path} instead")
+        self.output = open(self.path, "wb")
+
+    def _write_all(self):
+        """Internal function, the writer thread, writes frames until it gets None."""
+        try:
+            while True:
+                buffer = self.ready.get()
+                if buffer is None:
+                    break
+                if self.written == 0:
+                    self._open()
+                rgb = self._to_rgb(buffer)
+                # The buffer can be used again as soon as it's converted.
+                self.free.put(buffer)
+                if self.output is None:
+                    image = pg.image.frombuffer(rgb, self.layout[:2], "RGB")
+                    pg.image.save(image, self.path % self.written)
+                else:
+                    self.output.write(rgb)
+                self.written += 1
+        except Exception as error:
+            # No buffer comes back, so the rest of the frames are dropped.
+            self.error = error
+        finally:
+            if self.output:
+                self.output.close()
+            if self.encoder:
+                self.encoder.wait()
+
+    def stop(self):
+        """Waits for the frames that are left to be written."""
+        self.ready.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+        width, height = self.layout[:2] if self.layout else (0, 0)
+        return {"frames": self.frames, "written": self.written, "dropped": self.dropped,
+                "width": width, "height": height, "path": self.path}
+
+
+def start_capture(path, buffers=8):
+    """
+        Starts capturing every frame the game shows, written out on a
+        thread of its own. A path ending in .mp4, .mkv, .webm, .mov or .avi
+        is encoded by ffmpeg, if it's installed. A path with a % in it,
+        like "frames/%05d.png", gets one image per frame. Anything else,
+        like "match.raw", gets the frames one after another, as red, green
+        and blue bytes, the format ffmpeg calls rawvideo with rgb24.
+
+        buffers is how many frames can wait to be written. If the writer
+        can't keep up, frames are dropped instead of slowing down the
+        game. Frames are only captured when they are shown, so nothing is
+        captured headless.
+    """
+    global CAPTURE
+    if CAPTURE is not None:
+        stop_capture()
+    CAPTURE = _FrameWriter(path, buffers)
+
+
+def stop_capture():
+    """
+        Stops capturing and waits for the last frames to be written.
+        Returns how many frames there were, how many were written and
+        dropped, their size, and the path they went to.
+    """
+    global CAPTURE
+    writer, CAPTURE = CAPTURE, None
+    if writer is None:
+        return None
+    return writer.stop()
+
+#
+# Camera
+#
+
+class Camera:
+    """
+        Which part of a world bigger than the screen is shown. position is
+        the world position of the top left corner of the screen, in whole
+        pixels so things don't shimmer when it moves. Subtract it from
+        world positions to get where to draw them, and skip things that
+        aren't visible.
+
+        With bounds, the size of the world in pixels, the camera never
+        shows anything outside it. A world smaller than the screen stays
+        in the top left corner.
+    """
+
+    # How far from the edge of the screen follow keeps the focus point,
+    # as a part of the screen.
+    FOCUS_MARGIN = 0.2
+
+    def __init__(self, bounds=None):
+        self.bounds = bounds
+        self.position = np.zeros(2)
+
+    def size(self):
+        """The size of the view, the size of the screen."""
+        return np.array((SCREEN_WIDTH, SCREEN_HEIGHT), dtype=float)
+
+    def follow(self, points, smoothing=0.0, focus=None):
+        """
+            Moves the camera towards the middle of points, a numpy array
+            of world positions, like all the players. With smoothing
+            between 0 and 1, it only moves part of the way every call.
+            Returns True if the camera moved.
+
+            The middle of points that are further apart than the screen
+            can have none of them on the screen. focus is the index of the
+            point that is always on the screen, like the local player, at
+            least FOCUS_MARGIN of the screen from the edge. The rest are
+            only on the screen if they are close enough to it.
+        """
+        if not len(points):
+            return False
+        size = self.size()
+        middle = (points.min(axis=0) + points.max(axis=0)) / 2
+        target = middle - size / 2
+        if focus is not None:
+            point = points[focus]
+            target = np.clip(target, point - size * (1 - self.FOCUS_MARGIN),
+                             point - size * self.FOCUS_MARGIN)
+        if self.bounds is not None:
+            target = np.clip(target, 0, np.maximum(np.asarray(self.bounds) - size, 0))
+        target = self.position + (target - self.position) * (1 - smoothing)
+        target = np.round(target)
+        moved = (target != self.position).any()
+        self.position = target
+        return moved
+
+    def view(self, margin=0):
+        """The part of the world on the screen as a pg.Rect, grown by margin pixels."""
+        x, y = self.position.tolist()
+        width, height = self.size().tolist()
+        return pg.Rect(x - margin, y - margin, width + 2 * margin, height + 2 * margin)
+
+    def visible(self, centers, sizes):
+        """Takes numpy arrays of square boxes and says which are on the screen."""
+        half = (sizes / 2)[:, None]
+        return ((centers + half > self.position) &
+                (centers - half < self.position + self.size())).all(axis=1)
 
 #
 # Text drawing
 #
 
-LOADED_FONTS = {}
+LOADED_FONTS = OrderedDict()
+MAX_LOADED_FONTS = 100
+# Rendering text is slow, so the rendered text is kept and reused.
+TEXT_CACHE = SurfaceCache(1_000_000)
+
+
+def _load_font(font, size):
+    """Internal function, a loaded font, throwing away the least recently used."""
+    key = (font, size)
+    if key in LOADED_FONTS:
+        LOADED_FONTS.move_to_end(key)
+    else:
+        if len(LOADED_FONTS) >= MAX_LOADED_FONTS:
+            LOADED_FONTS.popitem(last=False)
+        LOADED_FONTS[key] = pg.font.SysFont(font, size)
+    return LOADED_FONTS[key]
+
+
 def draw_text(text, position, size=32, color=pg.Color(255, 255, 255), font=None):
     """
         Draw text at given position.
         The position is in pixels from the top left of the window.
         Optional arguments include size, color and font.
     """
-    global LOADED_FONTS
+    key = (text, size, tuple(color), font)
+    rendered_text = TEXT_CACHE.get(key)
+    if rendered_text is None:
+        rendered_text = _load_font(font, size).render(text, True, color)
+        TEXT_CACHE.put(key, rendered_text)
 
-    # Keep used fonts in memory.
-    # This is not a good solution if many different font sizes are used,
-    # but i cannot find a better way to do it...
-    if (font, size) not in LOADED_FONTS:
-        if len(LOADED_FONTS) > 100:
-            LOADED_FONTS.popitem()
-        LOADED_FONTS[(font, size)] = pg.font.SysFont(font, size)
+    window = pg.display.get_surface()
+    mark_dirty(window.blit(rendered_text, position))
 
-    font_obj = LOADED_FONTS[(font, size)]
+#
+# Asset loading
+#
 
-    rendered_text = font_obj.render(text, True, color)
+# What kind of asset a file is, from its ending.
+ASSET_KINDS = {".png": "image", ".jpg": "image", ".jpeg": "image", ".bmp": "image",
+               ".gif": "image", ".wav": "sound", ".ogg": "sound", ".mp3": "sound"}
 
-    window = pg.display.get_surface()
-    window.blit(rendered_text, position)
+
+def _placeholder(kind):
+    """Internal function, what an asset is until it has loaded."""
+    if kind == "image":
+        image = pg.Surface((32, 32))
+        image.fill(pg.Color(255, 0, 255))
+        image.fill(pg.Color(0, 0, 0), (0, 0, 16, 16))
+        image.fill(pg.Color(0, 0, 0), (16, 16, 16, 16))
+        return image
+    if pg.mixer.get_init():
+        # A very short silence.
+        return pg.mixer.Sound(buffer=bytes(64))
+    return None
+
+
+class Assets:
+    """
+        Loads the assets in a manifest, {name: path}, in the background on
+        workers threads, so the game doesn't wait for them before the
+        first frame. The kind of asset comes from the ending of the path,
+        or it can be given as {name: (kind, path)}.
+
+        assets[name] is the asset if it has loaded, and a placeholder
+        (a checkered square, or silence) if it hasn't. Images are turned
+        into the format of the window the first time they are used after
+        the window is made, so drawing them doesn't convert every pixel
+        every time. Assets can also be put in by hand, with
+        assets[name] = asset.
+    """
+
+    def __init__(self, manifest, workers=4):
+        self.manifest = {name: (entry if isinstance(entry, tuple) else
+                                (ASSET_KINDS[os.path.splitext(entry)[1].lower()], entry))
+                         for name, entry in manifest.items()}
+        self.workers = workers
+        self.futures = {}
+        self.loaded = {}
+        self.placeholders = {}
+        # Seconds from load until each asset was loaded.
+        self.load_times = {}
+
+    def load(self):
+        """Starts loading every asset in the manifest, without waiting for them."""
+        from concurrent.futures import ThreadPoolExecutor
+        start = perf_counter()
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix="assets")
+        for name, (kind, path) in self.manifest.items():
+            if name not in self.futures and name not in self.loaded:
+                self.futures[name] = executor.submit(self._load, name, kind, path, start)
+        # The threads stop when they are done with what they have.
+        executor.shutdown(wait=False)
+
+    def _load(self, name, kind, path, start):
+        """Internal function, loads one asset, on a worker thread."""
+        if kind == "image":
+            asset = pg.image.load(path)
+        elif kind == "sound":
+            asset = pg.mixer.Sound(path)
+        else:
+            raise ValueError(f"Can't load {name!r}, {kind!r} is not a kind of asset")
+        seconds = self.load_times[name] = perf_counter() - start
+        # The background loading is done when the slowest asset is.
+        STARTUP["assets"] = max(STARTUP.get("assets", 0), seconds)
+        return asset
+
+    def ready(self, name=None):
+        """Says if the asset, or every asset, has loaded."""
+        names = self.futures if name is None else (name, )
+        return all(self.futures[n].done() for n in names if n in self.futures)
+
+    def wait(self, name=None):
+        """Waits for the asset, or every asset, to load. Errors show up here."""
+        for n in list(self.futures) if name is None else (name, ):
+            if n in self.futures:
+                self.futures[n].result()
+
+    def __setitem__(self, name, asset):
+        self.futures.pop(name, None)
+        self.loaded[name] = asset
+
+    def __contains__(self, name):
+        return name in self.loaded or name in self.futures or name in self.manifest
+
+    def __getitem__(self, name):
+        asset = self.loaded.get(name)
+        if asset is not None:
+            return asset
+        future = self.futures.get(name)
+        if future is None or not future.done():
+            if name not in self.manifest:
+                raise KeyError(name)
+            if name not in self.placeholders:
+                self.placeholders[name] = _placeholder(self.manifest[name][0])
+            return self.placeholders[name]
+        asset = future.result()
+        if isinstance(asset, pg.Surface):
+            if pg.display.get_surface() is None:
+                # Converted later, when there is a window to convert to.
+                return asset
+            asset = asset.convert_alpha() if asset.get_flags() & pg.SRCALPHA else asset.convert()
+        del self.futures[name]
+        self.loaded[name] = asset
+        return asset
 
 #
 # Simple physics and collision
@@ -218,11 +912,326 @@ def solve_rect_overlap(a, b, vel_a=(0, 0), vel_b=(0, 0), mass_a=1, mass_b=1, bou
     return vel_a, vel_b, True
 
 
+def overlap_many(center_a, size_a, center_b, size_b):
+    """
+        Like overlap_data, but for many pairs at once. Takes numpy arrays
+        with one (x, y) row per body, and gives the same numbers as calling
+        overlap_data for every row.
+
+        returns -> normals, depths
+        (normals[i] points from body a[i])
+    """
+    delta = np.asarray(center_a, dtype=float) - np.asarray(center_b, dtype=float)
+    span = (np.asarray(size_a, dtype=float) + np.asarray(size_b, dtype=float)) / 2
+
+    # Pick the smallest overlapping axis
+    overlap = span - np.abs(delta)
+    overlap, delta = np.broadcast_arrays(overlap, delta)
+    depths = np.minimum(overlap[..., 0], overlap[..., 1])
+
+    along_x = np.abs(overlap[..., 0]) < np.abs(overlap[..., 1])
+    sign = np.where(delta > 0, 1.0, -1.0)
+    normals = np.zeros(overlap.shape)
+    normals[..., 0] = np.where(along_x, sign[..., 0], 0.0)
+    normals[..., 1] = np.where(along_x, 0.0, sign[..., 1])
+
+    return normals, depths
+
+
+def solve_many(center_a, size_a, center_b, size_b, vel_a=(0, 0), vel_b=(0, 0),
+               mass_a=1, mass_b=1, bounce=1):
+    """
+        Like solve_rect_overlap, but for many pairs at once. Every pair is
+        solved on its own, with the same numbers solve_rect_overlap gives.
+        Nothing is changed in place, the new values are returned.
+
+        returns -> center_a, center_b, vel_a, vel_b, hit
+    """
+    normals, depths = overlap_many(center_a, size_a, center_b, size_b)
+    hit = depths >= 0
+
+    mass_a = np.asarray(mass_a, dtype=float)[..., None]
+    mass_b = np.asarray(mass_b, dtype=float)[..., None]
+    total_mass = mass_a + mass_b
+    moves = hit[..., None] & (total_mass != 0)
+    # Avoid dividing by zero, those pairs don't move anyway.
+    safe_mass = np.where(total_mass != 0, total_mass, 1.0)
+
+    # Positional correction
+    push = normals * depths[..., None]
+    center_a = np.where(moves, center_a + push * (mass_a / safe_mass), center_a)
+    center_b = np.where(moves, center_b - push * (mass_b / safe_mass), center_b)
+
+    # Velocity correction
+    vel_a = np.asarray(vel_a, dtype=float)
+    vel_b = np.asarray(vel_b, dtype=float)
+    dot_a = vel_a[..., 0] * normals[..., 0] + vel_a[..., 1] * normals[..., 1]
+    dot_b = vel_b[..., 0] * normals[..., 0] + vel_b[..., 1] * normals[..., 1]
+    relative_v = ((1 + bounce) * (dot_a - dot_b))[..., None]
+    bounces = moves & (relative_v < 0)
+    vel_a = np.where(bounces, vel_a + normals * (-relative_v * mass_a / safe_mass), vel_a)
+    vel_b = np.where(bounces, vel_b + normals * (relative_v * mass_b / safe_mass), vel_b)
+
+    return center_a, center_b, vel_a, vel_b, hit
+
+
+def sweep_many(center_a, size_a, move_a, center_b, size_b, move_b=(0, 0)):
+    """
+        Continuous collision for many pairs of boxes at once. Box a moves
+        move_a and box b moves move_b during the step, in straight lines,
+        starting at the centers. Fast boxes that would pass through
+        eachother between two steps still hit.
+
+        times are when the boxes first touch, from 0 (the start of the
+        step) to 1 (the end), and np.inf if they don't touch during the
+        step. Boxes that already overlap at the start hit at 0, with a
+        normal of (0, 0).
+
+        returns -> times, normals
+        (normals[i] points from body b[i], towards a[i])
+    """
+    move = np.asarray(move_a, dtype=float) - np.asarray(move_b, dtype=float)
+    gap = np.asarray(center_b, dtype=float) - np.asarray(center_a, dtype=float)
+    span = (np.asarray(size_a, dtype=float) + np.asarray(size_b, dtype=float)) / 2
+    move, gap, span = np.broadcast_arrays(move, gap, span)
+
+    # When the boxes start and stop overlapping along every axis, the
+    # boxes touch when they overlap along both.
+    still = move == 0
+    safe_move = np.where(still, 1.0, move)
+    enter = (gap - np.sign(safe_move) * span) / safe_move
+    leave = (gap + np.sign(safe_move) * span) / safe_move
+    # Not moving along an axis, they overlap along it always or never.
+    apart = np.abs(gap) >= span
+    enter = np.where(still, np.where(apart, np.inf, -np.inf), enter)
+    leave = np.where(still, np.where(apart, -np.inf, np.inf), leave)
+
+    along_x = enter[..., 0] > enter[..., 1]
+    first = np.maximum(enter[..., 0], enter[..., 1])
+    last = np.minimum(leave[..., 0], leave[..., 1])
+    hit = (first < last) & (first <= 1) & (last > 0)
+    times = np.where(hit, np.maximum(first, 0), np.inf)
+
+    normals = np.zeros(move.shape)
+    side = -np.sign(move)
+    touching = hit & (first >= 0)
+    normals[..., 0] = np.where(touching & along_x, side[..., 0], 0.0)
+    normals[..., 1] = np.where(touching & ~along_x, side[..., 1], 0.0)
+    return times, normals
+
+
+def sweep(a, b, move_a, move_b=(0, 0)):
+    """
+        Like sweep_many, for one pair of bodies. Returns when a, moving
+        move_a, first touches b, moving move_b, from 0 to 1 or math.inf
+        if it doesn't, and the normal pointing from b.
+
+        returns -> time, normal
+    """
+    times, normals = sweep_many((a.centerx, a.centery), (a.width, a.height), move_a,
+                                (b.centerx, b.centery), (b.width, b.height), move_b)
+    return float(times), tuple(normals.tolist())
+
+
 def damping(vel, damp=0.1):
     """Slows down an object by damp factor per second."""
     fac = damp ** DELTA
     return vel[0] * fac, vel[1] * fac
 
+
+def _index_ranges(first, last):
+    """
+        Internal function, takes arrays of ranges and returns every
+        (i, j) with first[i] <= j < last[i], without a python loop.
+    """
+    counts = np.maximum(last - first, 0)
+    a = np.repeat(np.arange(len(first)), counts)
+    offset = np.arange(len(a)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return a, np.repeat(first, counts) + offset
+
+
+def overlapping_pairs(centerx, centery, width, height):
+    """
+        Takes numpy arrays describing many bodies, and finds every pair of
+        bodies that overlap.
+
+        returns -> a, b
+        (two arrays of indices, body a[i] overlaps body b[i])
+    """
+    empty = np.zeros(0, dtype=int)
+    if len(centerx) < 2 or height.max() <= 0:
+        return empty, empty
+
+    # Cut the world into rows as high as the highest body, then every body
+    # can only touch bodies in its own row and the rows next to it. Sorting
+    # on row first and x second lets searchsorted find the neighbours.
+    row = np.floor(centery / height.max())
+    x = centerx - centerx.min()
+    reach = (width + width.max()) / 2
+    stride = x.max() + 2 * reach.max() + 1
+    key = row * stride + x
+
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    reach = reach[order]
+
+    same_row = _index_ranges(np.arange(1, len(key) + 1),
+                             np.searchsorted(key, key + reach, side="left"))
+    next_row = _index_ranges(np.searchsorted(key, key + stride - reach, side="right"),
+                             np.searchsorted(key, key + stride + reach, side="left"))
+    a = order[np.concatenate((same_row[0], next_row[0]))]
+    b = order[np.concatenate((same_row[1], next_row[1]))]
+
+    overlap = ((np.abs(centerx[a] - centerx[b]) < (width[a] + width[b]) / 2) &
+               (np.abs(centery[a] - centery[b]) < (height[a] + height[b]) / 2))
+    return a[overlap], b[overlap]
+
+#
+# Timing
+#
+
+SECTION_TIMES = {}
+@contextmanager
+def timed(name):
+    """
+        Measures how long the code inside the with block takes, and adds
+        the seconds to SECTION_TIMES[name].
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        SECTION_TIMES[name] = SECTION_TIMES.get(name, 0) + perf_counter() - start
+
+# While profiling, the times of every frame are saved in PROFILE, one dict
+# per frame with the frame time and the time of every section, all in
+# milliseconds. "work ms" is the frame time without waiting for the next
+# frame. The main loop times its own parts as "loop: ..." sections.
+PROFILE = None
+PROFILE_OVERLAY = False
+_OVERLAY_LINES = []
+_OVERLAY_UPDATED = 0.0
+
+
+def start_profiling(overlay=False, frames=10_000):
+    """
+        Starts saving how long every frame and section takes, keeping the
+        latest frames. With overlay, the numbers are drawn on the screen.
+    """
+    global PROFILE, PROFILE_OVERLAY
+    PROFILE = deque(maxlen=frames)
+    PROFILE_OVERLAY = overlay
+    SECTION_TIMES.clear()
+
+
+def stop_profiling():
+    """Stops profiling, and returns the saved frames."""
+    global PROFILE, PROFILE_OVERLAY
+    samples = list(PROFILE or ())
+    PROFILE = None
+    PROFILE_OVERLAY = False
+    return samples
+
+
+def _end_frame(seconds):
+    """Internal function, saves the times of the frame that just ended."""
+    if "first frame" not in STARTUP:
+        _startup_phase("first frame")
+    if PROFILE is None:
+        return
+    sample = {"frame ms": seconds * 1000,
+              "work ms": (seconds - SECTION_TIMES.get("loop: sleep", 0)) * 1000}
+    for name, section_seconds in SECTION_TIMES.items():
+        sample[name] = section_seconds * 1000
+    PROFILE.append(sample)
+    SECTION_TIMES.clear()
+
+
+# How long starting the game took, in seconds per phase, in the order they
+# happened: importing everything before start_game, starting pygame, the
+# init function, opening the window and the first frame. "assets" is the
+# time Assets spent loading in the background, from load until the last
+# asset was ready, so it overlaps the others.
+STARTUP = {}
+_STARTUP_MARK = _IMPORT_START
+
+
+def _startup_phase(name):
+    """Internal function, ends a phase of starting the game."""
+    global _STARTUP_MARK
+    now = perf_counter()
+    STARTUP[name] = now - _STARTUP_MARK
+    _STARTUP_MARK = now
+
+
+def startup_report():
+    """How long every phase of starting the game took, see STARTUP, as one line in ms."""
+    phases = [name for name in STARTUP if name != "assets"]
+    parts = [f"{name} {STARTUP[name] * 1000:.1f}" for name in phases]
+    parts.append(f"total {sum(STARTUP[name] for name in phases) * 1000:.1f}")
+    if "assets" in STARTUP:
+        parts.append(f"(assets in the background {STARTUP['assets'] * 1000:.1f})")
+    return "startup ms: " + ", ".join(parts)
+
+
+def percentile(values, p):
+    """The value p percent of the values are smaller than."""
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def frame_percentiles(column="work ms", percents=(50, 95, 99)):
+    """The percentiles of a column of the saved frames, as {percent: ms}."""
+    values = [sample.get(column, 0) for sample in PROFILE or ()]
+    return {p: percentile(values, p) for p in percents}
+
+
+def save_profile(path):
+    """
+        Writes the saved frames to path, as JSON if it ends with .json and
+        as CSV (one row per frame) otherwise.
+    """
+    samples = list(PROFILE or ())
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump({"work ms percentiles": frame_percentiles(), "frames": samples}, f)
+        return
+
+    columns = []
+    for sample in samples:
+        columns += [name for name in sample if name not in columns]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, columns, restval=0)
+        writer.writeheader()
+        writer.writerows(samples)
+
+
+def draw_profile(position=(5, 5), size=16, sections=6, color=pg.Color(255, 255, 0)):
+    """
+        Draws the frame time percentiles, and the slowest sections over the
+        last second. The numbers change twice a second, so they can be read.
+    """
+    global _OVERLAY_LINES, _OVERLAY_UPDATED
+    if PROFILE is None:
+        return
+    if perf_counter() - _OVERLAY_UPDATED > 0.5:
+        _OVERLAY_UPDATED = perf_counter()
+        p = frame_percentiles()
+        _OVERLAY_LINES = [f"work p50 {p[50]:.2f} p95 {p[95]:.2f} p99 {p[99]:.2f} ms"]
+        recent = list(PROFILE)[-60:]
+        totals = {}
+        for sample in recent:
+            for name, ms in sample.items():
+                if not name.endswith(" ms") and name != "loop: sleep":
+                    totals[name] = totals.get(name, 0) + ms
+        slowest = sorted(totals.items(), key=lambda item: -item[1])[:sections]
+        _OVERLAY_LINES += [f"{name} {ms / len(recent):.2f} ms" for name, ms in slowest]
+
+    for i, line in enumerate(_OVERLAY_LINES):
+        draw_text(line, (position[0], position[1] + i * size), size, color)
+
 #
 # Main loop
 # (with global state needed for code to work)
@@ -231,13 +1240,26 @@ def damping(vel, damp=0.1):
 
 UPDATE_FUNC = None
 UPDATE_ITER = None
+DRAW_FUNC = None
 
 FRAMERATE = 60
 DELTA = 1 / FRAMERATE
 TIME = 0
 FRAME_CLOCK = pg.time.Clock()
 
+# With a draw function the simulation runs in steps of exactly SIM_DELTA,
+# no matter how fast the frames are drawn.
+SIM_RATE = 60
+SIM_DELTA = 1 / SIM_RATE
+# If the computer is too slow to keep up, the game slows down instead of
+# trying to catch up with even more steps every frame.
+MAX_STEPS_PER_FRAME = 5
+ALPHA = 1.0
+
 PYGAME_INITALIZED = False
+HEADLESS = False
+# Called before every step of update, see set_input_hook.
+INPUT_HOOK = None
 
 SCREEN_WIDTH = 500
 SCREEN_HEIGHT = 500
@@ -259,20 +1281,53 @@ def set_frame_rate(fps):
     DELTA = 1 / FRAMERATE
 
 
+def set_sim_rate(steps):
+    """Sets how many simulation steps a second there are, with a draw function."""
+    global SIM_RATE, SIM_DELTA
+    SIM_RATE = steps
+    SIM_DELTA = 1 / SIM_RATE
+
+
+def set_input_hook(hook):
+    """
+        hook() is called before every step of update, after the buttons
+        are read, so it can look at or change the held buttons, to record
+        them or to play them back. If it returns False the game stops.
+        None removes the hook.
+    """
+    global INPUT_HOOK
+    INPUT_HOOK = hook
+
+
 def time():
     """Return the time since the program started."""
     return TIME
 
 
+def headless():
+    """Return True if the game runs without a window."""
+    return HEADLESS
+
+
 def delta():
     """Return the time passed from the previous frame to this frame."""
-    if FRAMERATE:
+    if DRAW_FUNC:
+        return SIM_DELTA
+    if FRAMERATE or HEADLESS:
         return DELTA
     # I know this looks wierd, but "get_time" returns the "delta",
     # really wierd.
     return FRAME_CLOCK.get_time() / 1000.0
 
 
+def alpha():
+    """
+        Return how far the frame being drawn is between the last two
+        simulation steps, from 0 (the one before) to 1 (the last one).
+    """
+    return ALPHA
+
+
 def restart():
     """Reruns the initalization code of the game"""
     global UPDATE_FUNC, UPDATE_ITER, TIME
@@ -280,10 +1335,145 @@ def restart():
     TIME = 0
 
 
-def start_game(init, update):
-    """The program starts here"""
-    pg.init()
+def _step():
+    """Internal function, runs the update function once. False when it's done."""
+    if INPUT_HOOK and INPUT_HOOK() is False:
+        return False
+    try:
+        next(UPDATE_ITER)
+    except StopIteration:
+        return False
+    return True
+
+
+def run_steps(steps):
+    """
+        Runs update steps times right now, without drawing or waiting, to
+        skip ahead. The held buttons work like in the main loop. Returns
+        False if the game stopped.
+    """
+    global TIME
+    for _ in range(steps):
+        TIME += delta()
+        if not _step():
+            return False
+        _next_input_frame()
+    return True
+
+
+def _run_frames(max_frames):
+    """Internal function, the main loop with one update per drawn frame."""
+    global TIME
+    frames = 0
+    while True:
+        frame_start = perf_counter()
+        # See what buttons are pressed this frame, and continue if we haven't quit.
+        with timed("loop: events"):
+            if not process_events():
+                break
+        # Tell Pygame we're on a new frame, with the given framerate
+        # set it to zero to unlimit.
+        if not HEADLESS:
+            with timed("loop: sleep"):
+                FRAME_CLOCK.tick(FRAMERATE)
+        TIME += DELTA
+
+        # Let you do what you need to do.
+        with timed("loop: update"):
+            if not _step():
+                break
+        frames += 1
+
+        # Update the display
+        if not HEADLESS:
+            if PROFILE_OVERLAY:
+                draw_profile()
+            with timed("loop: present"):
+                present()
+        _end_frame(perf_counter() - frame_start)
+
+        if max_frames is not None and frames >= max_frames:
+            break
+    return frames
+
+
+def _run_fixed_steps(max_frames):
+    """
+        Internal function, the main loop with a fixed simulation step.
+        The time every drawn frame takes is saved up, and spent in steps
+        of SIM_DELTA. The time left over is how far to draw between the
+        last two steps.
+    """
+    global TIME, ALPHA
+    frames = 0
+    saved_time = 0.0
+    _next_input_frame()
+    while True:
+        frame_start = perf_counter()
+        with timed("loop: events"):
+            if not process_events(new_frame=False):
+                break
+        if HEADLESS:
+            steps = 1
+        else:
+            with timed("loop: sleep"):
+                FRAME_CLOCK.tick(FRAMERATE)
+            saved_time += FRAME_CLOCK.get_time() / 1000.0
+            steps = int(saved_time // SIM_DELTA)
+            if steps > MAX_STEPS_PER_FRAME:
+                # Too far behind, forget about the time we can't catch up on.
+                steps = MAX_STEPS_PER_FRAME
+                saved_time = steps * SIM_DELTA
+            saved_time -= steps * SIM_DELTA
+
+        for _ in range(steps):
+            TIME += SIM_DELTA
+            with timed("loop: update"):
+                if not _step():
+                    return frames
+            # Key presses only count for the first step they are seen in.
+            _next_input_frame()
+            frames += 1
+            if max_frames is not None and frames >= max_frames:
+                return frames
+
+        if not HEADLESS:
+            ALPHA = saved_time / SIM_DELTA
+            with timed("loop: draw"):
+                DRAW_FUNC()
+            if PROFILE_OVERLAY:
+                draw_profile()
+            with timed("loop: present"):
+                present()
+        _end_frame(perf_counter() - frame_start)
+    return frames
+
+
+def start_game(init, update, headless=False, max_frames=None, draw=None):
+    """
+        The program starts here
+
+        In headless mode there is no window and no sound, the game doesn't
+        wait between frames and every frame is DELTA seconds long, so it
+        runs as fast as the computer can simulate it.
+
+        With a draw function, update only simulates and runs SIM_RATE times
+        a second whatever the frame rate is, and draw is called once every
+        frame to draw the state between the last two steps.
+    """
+    global HEADLESS, DRAW_FUNC
+    _startup_phase("import")
+    HEADLESS = headless
+    DRAW_FUNC = draw
+    if headless:
+        # Pygame draws to memory and plays sound to nowhere with these.
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+    # Only the parts of pygame the game uses, pg.init() would start
+    # joysticks and everything else too.
     pg.display.init()
+    pg.font.init()
     pg.mixer.init()
 
     global PYGAME_INITALIZED
@@ -291,36 +1481,34 @@ def start_game(init, update):
 
     global FRAME_CLOCK
     FRAME_CLOCK = pg.time.Clock()
+    _startup_phase("pygame init")
 
     # Let you do initalization
     init()
+    _startup_phase("init")
 
     # Sets the screen resolution.
     set_screen_size(SCREEN_WIDTH, SCREEN_HEIGHT)
+    _startup_phase("window")
 
-    global UPDATE_FUNC, TIME
+    global UPDATE_FUNC
     UPDATE_FUNC = update
     # First start is a restart.
     restart()
 
-    # See what buttons are pressed this frame, and continue if we haven't quit.
-    while process_events():
-        # Tell Pygame we're on a new frame, with the given framerate
-        # set it to zero to unlimit.
-        FRAME_CLOCK.tick(FRAMERATE)
-        TIME += DELTA
-
-        # Let you do what you need to do.
-        try:
-            next(UPDATE_ITER)
-        except StopIteration:
-            break
+    start = perf_counter()
+    if draw:
+        frames = _run_fixed_steps(max_frames)
+    else:
+        frames = _run_frames(max_frames)
+    elapsed = perf_counter() - start
 
-        # Update the display
-        pg.display.flip()
-        clear_screen(pg.Color(0, 0, 0))
+    if headless:
+        fps = frames / elapsed if elapsed else 0
+        print(f"Simulated {frames} frames ({frames * delta():.1f} s of game time) "
+              f"in {elapsed:.2f} s, {fps:.0f} frames per second")
 
     pg.mixer.quit()
     pg.display.quit()
     pg.quit()
-
+    return frames, elapsed
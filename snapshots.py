@@ -0,0 +1,207 @@
+"""
+Snapshots of the whole game, for rewinding, replays and rollback.
+
+A Snapshot is one numpy buffer with a fixed layout: the players, the live
+shots, the scores and kill feed, the time and the buttons held in ribs.
+Saving copies the game into the buffer and restoring copies it back into
+the arrays the game already has, so neither makes new players or shots.
+SnapshotRing keeps the last few frames around.
+
+    ring = SnapshotRing(120)
+    ring.save(frame)
+    ...
+    ring.restore(frame - 30)
+"""
+import numpy as np
+
+import ribs
+import game
+
+# The most buttons held at once that are saved, the rest are forgotten.
+HELD_KEYS = 32
+
+
+def _layout(players, shots, shooters):
+    """
+        Internal function, the layout of a snapshot with room for players
+        players, shots shots and shooter_idx up to shooters, as a numpy
+        structured dtype. The three sizes come first, so a snapshot read
+        back from bytes knows its layout.
+    """
+    fields = [("players_capacity", np.int64), ("shots_capacity", np.int64),
+              ("shooters_capacity", np.int64),
+              ("frame", np.int64), ("time", np.float64), ("new_round", np.bool_),
+              ("player_count", np.int64), ("shot_count", np.int64),
+              ("fired", np.int64), ("culled", np.int64),
+              ("per_shooter", np.int64, (shooters, )), ("scores", np.int64, (shooters, )),
+              ("held", np.int64, (HELD_KEYS, )), ("held_count", np.int64),
+              ("last_held", np.int64, (HELD_KEYS, )), ("last_held_count", np.int64),
+              ("feed", [("time", np.float64), ("shooter", np.int64), ("victim", np.int64)],
+               (game.KILL_FEED_LENGTH, )),
+              ("feed_count", np.int64)]
+    for prefix, pool, rows in (("player_", game.players, players), ("shot_", game.shots, shots)):
+        for name in pool.ARRAYS:
+            array = getattr(pool, name)
+            fields.append((prefix + name, array.dtype, (rows, ) + array.shape[1:]))
+    return np.dtype(fields)
+
+
+class Snapshot:
+    """
+        One saved state of the game. Use save and restore, or SnapshotRing,
+        instead of the methods here. bytes(snapshot) is the whole buffer,
+        and Snapshot.from_bytes reads it back.
+    """
+
+    def __init__(self, players, shots, shooters):
+        self.state = np.zeros((), _layout(players, shots, shooters))
+        self.state["players_capacity"] = players
+        self.state["shots_capacity"] = shots
+        self.state["shooters_capacity"] = shooters
+        # Views of every field, so saving doesn't look them up every time.
+        self.fields = {name: self.state[name] for name in self.state.dtype.names}
+
+    @classmethod
+    def for_game(cls):
+        """A snapshot with room for the game as it is now, and then some."""
+        shooters = max(len(game.shots.per_shooter), max(game.scores, default=0) + 1)
+        return cls(len(game.players.size), len(game.shots.size), shooters)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Reads back a snapshot from bytes(snapshot)."""
+        players, shots, shooters = np.frombuffer(data, dtype=np.int64, count=3).tolist()
+        snapshot = cls(players, shots, shooters)
+        snapshot.state[...] = np.frombuffer(data, dtype=snapshot.state.dtype, count=1)[0]
+        return snapshot
+
+    def __bytes__(self):
+        return self.state.tobytes()
+
+    @property
+    def frame(self):
+        return int(self.fields["frame"])
+
+    def fits(self):
+        """Says if the game as it is now fits in the snapshot."""
+        fields = self.fields
+        return (len(game.players) <= fields["players_capacity"] and
+                len(game.shots) <= fields["shots_capacity"] and
+                len(game.shots.per_shooter) <= fields["shooters_capacity"] and
+                max(game.scores, default=0) < fields["shooters_capacity"])
+
+
+def save(snapshot=None, frame=-1, time=None):
+    """
+        Saves the game into snapshot, if it fits, or into a new snapshot.
+        Returns the snapshot it was saved in. time is saved instead of the
+        time in ribs, if it's given.
+    """
+    if snapshot is None or not snapshot.fits():
+        snapshot = Snapshot.for_game()
+    fields = snapshot.fields
+    fields["frame"][...] = frame
+    fields["time"][...] = ribs.TIME if time is None else time
+    fields["new_round"][...] = game.new_round
+
+    for prefix, pool in (("player_", game.players), ("shot_", game.shots)):
+        n = len(pool)
+        for name in pool.ARRAYS:
+            fields[prefix + name][:n] = getattr(pool, name)[:n]
+    fields["player_count"][...] = len(game.players)
+    fields["shot_count"][...] = len(game.shots)
+    fields["fired"][...] = game.shots.fired
+    fields["culled"][...] = game.shots.culled
+
+    shooters = len(game.shots.per_shooter)
+    fields["per_shooter"][:shooters] = game.shots.per_shooter
+    fields["per_shooter"][shooters:] = 0
+    scores = fields["scores"]
+    scores[:] = 0
+    for idx, score in game.scores.items():
+        scores[idx] = score
+
+    for name, held in (("held", ribs.current_frame_held_buttons),
+                       ("last_held", ribs.last_frame_held_buttons)):
+        keys = fields[name]
+        count = 0
+        for key in held:
+            if count < HELD_KEYS:
+                keys[count] = key
+                count += 1
+        fields[name + "_count"][...] = count
+
+    feed = fields["feed"]
+    for i, (when, shooter_idx, victim_idx) in enumerate(game.kill_feed):
+        feed[i] = when, shooter_idx, victim_idx
+    fields["feed_count"][...] = len(game.kill_feed)
+    return snapshot
+
+
+def restore(snapshot):
+    """Puts the game back the way it was when snapshot was saved."""
+    fields = snapshot.fields
+    ribs.TIME = float(fields["time"])
+    game.new_round = bool(fields["new_round"])
+
+    players = game.players
+    # Only the first restore into a fresh game makes new players.
+    while len(players) < fields["player_count"]:
+        players.add(0)
+    players.count = int(fields["player_count"])
+    shots = game.shots
+    shots.count = 0
+    while len(shots.size) < fields["shot_count"]:
+        shots._grow()
+    shots.count = int(fields["shot_count"])
+    for prefix, pool in (("player_", players), ("shot_", shots)):
+        n = len(pool)
+        for name in pool.ARRAYS:
+            getattr(pool, name)[:n] = fields[prefix + name][:n]
+    shots.fired = int(fields["fired"])
+    shots.culled = int(fields["culled"])
+
+    per_shooter = fields["per_shooter"]
+    shots._count_shooters(len(per_shooter) - 1)
+    shots.per_shooter[:len(per_shooter)] = per_shooter
+    shots.per_shooter[len(per_shooter):] = 0
+    game.scores.clear()
+    for idx in np.flatnonzero(fields["scores"]).tolist():
+        game.scores[idx] = int(fields["scores"][idx])
+
+    for name, held in (("held", ribs.current_frame_held_buttons),
+                       ("last_held", ribs.last_frame_held_buttons)):
+        held.clear()
+        held.update(fields[name][:int(fields[name + "_count"])].tolist())
+
+    game.kill_feed[:] = [(when, shooter_idx, victim_idx) for when, shooter_idx, victim_idx in
+                         fields["feed"][:int(fields["feed_count"])].tolist()]
+
+
+class SnapshotRing:
+    """
+        The last length frames, saved with save(frame). The snapshots are
+        made once and then saved over, so a ring that has gone round once
+        doesn't make new ones (unless the game outgrows them).
+    """
+
+    def __init__(self, length=120):
+        self.snapshots = [None] * length
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __contains__(self, frame):
+        snapshot = self.snapshots[frame % len(self.snapshots)]
+        return snapshot is not None and snapshot.frame == frame
+
+    def save(self, frame, time=None):
+        """Saves the game as frame, over the oldest frame in the ring."""
+        slot = frame % len(self.snapshots)
+        self.snapshots[slot] = save(self.snapshots[slot], frame, time)
+
+    def restore(self, frame):
+        """Puts the game back to frame, which has to be one of the last length frames."""
+        if frame not in self:
+            raise KeyError(f"Frame {frame} is not in the ring")
+        restore(self.snapshots[frame % len(self.snapshots)])